@@ -0,0 +1,129 @@
+"""Load benchmark for the HTTP endpoints.
+
+Usage:
+    python benchmarks/bench_load.py                      # self-contained, waitress
+    python benchmarks/bench_load.py --server development # self-contained, Flask dev server
+    python benchmarks/bench_load.py --url http://host:5000 --clients 16 --duration 20
+
+Without --url the app is started in-process on a free port with a fixed fake
+snapshot published and no fetch loop, so results are reproducible without an
+Enpal box. Every client thread keeps its own keep-alive session and requests
+the endpoints round-robin. Reports requests per second and p50/p99 latency per
+endpoint.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+ENDPOINTS = ["/health", "/solar_generation", "/grid_power", "/battery_data", "/snapshot"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def start_local_server(server, threads):
+    """Start enpal.app with a fake snapshot on a free port and return its base URL."""
+    os.environ.setdefault("INFLUX_HOSTS", "127.0.0.1")
+    # Keep the service inside its operating window, otherwise /health serves the standby body
+    os.environ.setdefault("START_TIME", "00:00")
+    os.environ.setdefault("END_TIME", "23:59")
+    import logging
+    import enpal
+
+    logging.getLogger().setLevel(logging.ERROR)
+    enpal.default_site.initialization_phase = False
+    enpal.default_site.current_snapshot = enpal.Snapshot(
+        {"solar_power_generation": 3512.5},
+        {"grid_power": 812.0},
+        {"battery_charge_discharge": 1450.25, "battery_charge_level": 63.0},
+        successful=True,
+        initialization_phase=True,
+        source_time=time.time(),
+    )
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    if server == "production":
+        from waitress import serve
+        target = lambda: serve(enpal.app, host="127.0.0.1", port=port, threads=threads, _quiet=True)
+    else:
+        target = lambda: enpal.app.run(host="127.0.0.1", port=port, debug=False)
+    threading.Thread(target=target, daemon=True).start()
+
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/health", timeout=1)
+            return url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError("Local server did not start")
+
+
+def client(url, endpoints, deadline, results, errors, offset):
+    session = requests.Session()
+    index = offset
+    while time.monotonic() < deadline:
+        endpoint = endpoints[index % len(endpoints)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(url + endpoint, timeout=5)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 500:
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+            else:
+                results[endpoint].append(elapsed)
+        except requests.exceptions.RequestException:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running instance; omit to start one in-process")
+    parser.add_argument("--server", choices=["production", "development"], default="production")
+    parser.add_argument("--threads", type=int, default=8, help="Worker threads of the in-process production server")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    args = parser.parse_args()
+
+    endpoints = args.endpoints.split(",")
+    url = args.url or start_local_server(args.server, args.threads)
+    results = {endpoint: [] for endpoint in endpoints}
+    errors = {}
+    deadline = time.monotonic() + args.duration
+    workers = [threading.Thread(target=client, args=(url, endpoints, deadline, results, errors, i)) for i in range(args.clients)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    target = args.url or f"in-process {args.server} server"
+    print(f"{target}, {args.clients} clients, {elapsed:.1f}s")
+    total = 0
+    for endpoint in endpoints:
+        latencies = sorted(results[endpoint])
+        total += len(latencies)
+        print(f"{endpoint:20} {len(latencies) / elapsed:8.0f} req/s  p50 {percentile(latencies, 0.5) * 1000:6.2f} ms"
+              f"  p99 {percentile(latencies, 0.99) * 1000:6.2f} ms  errors {errors.get(endpoint, 0)}")
+    print(f"{'total':20} {total / elapsed:8.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Micro-benchmark: annotated-CSV parser vs. the former pandas parsing path.
+
+Usage:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_parse.py [--iterations 5000]
+
+Parses a realistic combined five-field response (with and without the
+#datatype/#group/#default annotations) and reports the time per parse plus the
+cost of importing pandas in a fresh interpreter.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import timeit
+from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("INFLUX_HOSTS", "127.0.0.1")
+
+import enpal  # noqa: E402
+
+try:
+    import pandas as pd
+except ImportError:  # Optional, only the enpal parser is measured then
+    pd = None
+
+FIELDS = {
+    enpal.SOLAR_FIELD: 3512.5,
+    enpal.GRID_EXPORT_FIELD: 812.0,
+    enpal.GRID_IMPORT_FIELD: 0.0,
+    enpal.BATTERY_POWER_FIELD: 1450.25,
+    enpal.BATTERY_LEVEL_FIELD: 63.0,
+}
+
+
+def build_response(annotations):
+    """Build a response shaped like the combined last() query of the Enpal box."""
+    lines = []
+    if annotations:
+        lines += [
+            "#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,double,string,string",
+            "#group,false,false,true,true,false,false,true,true",
+            "#default,_result,,,,,,,",
+        ]
+    lines.append(",result,table,_start,_stop,_time,_value,_field,_measurement")
+    for table, (field, value) in enumerate(FIELDS.items()):
+        lines.append(f",,{table},2024-06-01T10:55:00Z,2024-06-01T11:00:00Z,2024-06-01T10:59:52.123Z,{value},{field},inverter")
+    return "\r\n".join(lines) + "\r\n\r\n"
+
+
+def parse_with_pandas(text):
+    """The lookup pattern enpal.py used before the dedicated parser."""
+    df = pd.read_csv(StringIO(text))
+    values = {}
+    for field in FIELDS:
+        if field in df['_field'].values:
+            values[field] = float(df[df['_field'] == field]['_value'].iloc[-1])
+    return values
+
+
+def parse_with_enpal(text):
+    return {field: value for field, (_, value) in enpal.parse_influx_csv(text.splitlines()).items()}
+
+
+def import_seconds(module):
+    """Wall time of importing a module in a fresh interpreter."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    if pd is None:
+        print("pandas is not installed, only the enpal parser is measured")
+
+    for annotations in (False, True):
+        text = build_response(annotations)
+        label = "annotated" if annotations else "plain"
+        assert parse_with_enpal(text) == FIELDS
+        enpal_us = timeit.timeit(lambda: parse_with_enpal(text), number=args.iterations) / args.iterations * 1e6
+        print(f"{label:9} enpal.parse_influx_csv: {enpal_us:9.1f} us/parse")
+        if pd is not None and not annotations:
+            # The pandas path never understood the annotation rows, so only the plain dialect is comparable
+            assert parse_with_pandas(text) == FIELDS
+            pandas_us = timeit.timeit(lambda: parse_with_pandas(text), number=args.iterations) / args.iterations * 1e6
+            print(f"{label:9} pandas read_csv path:  {pandas_us:9.1f} us/parse ({pandas_us / enpal_us:.0f}x slower)")
+
+    baseline = import_seconds("json")
+    print(f"interpreter start + import json:   {baseline * 1000:7.0f} ms")
+    if pd is not None:
+        print(f"interpreter start + import pandas: {import_seconds('pandas') * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
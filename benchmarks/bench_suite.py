@@ -0,0 +1,348 @@
+"""End-to-end benchmark suite against local fake InfluxDB hosts.
+
+Usage:
+    python benchmarks/bench_suite.py                        # run everything, save benchmarks/results/<commit>.json
+    python benchmarks/bench_suite.py --only cycle,failover  # a subset
+    python benchmarks/bench_suite.py --compare 1a2b3c4      # compare with a saved run
+
+Starts two FakeInflux hosts (benchmarks/fake_influx.py) on free ports, points
+INFLUX_HOSTS at them and imports enpal.py, so every number goes through the
+real fetch path: HTTP session, Flux query, CSV parsing, history, derived
+values and snapshot rendering. Measured:
+
+    cycle     fetch_data() wall time and bytes on the wire per cycle, combined
+              and separate mode
+    parse     size and parse time of the combined response: annotated CSV with
+              all columns as before, the minimal dialect, and that gzipped and
+              decompressed while parsed (iter_response_lines)
+    failover  seconds and cycles until a cycle succeeds on the other host after
+              the working one starts resetting connections, answering 500 or hanging
+    memory    tracemalloc growth per simulated day of 10 s cycles, once the
+              history ring buffers are full (flat when nothing leaks)
+    endpoint  requests per second and p50/p99 of the HTTP endpoints (bench_load.py)
+
+Results are written as JSON named after the short commit hash (with -dirty for
+uncommitted changes), so runs on two commits can be compared with --compare.
+Numbers are only comparable between runs on the same machine.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from fake_influx import FakeInflux  # noqa: E402
+
+SUITES = ["cycle", "parse", "failover", "memory", "endpoint"]
+
+# Lower is better for everything except throughput
+HIGHER_IS_BETTER = ("req_per_s",)
+
+
+def configure(hosts):
+    """Environment for importing enpal.py against the fake hosts, with nothing listening or persisted."""
+    os.environ.update({
+        "INFLUX_HOSTS": ",".join(hosts),
+        "INFLUX_TOKEN": "bench",
+        "INFLUX_ORG_ID": "bench",
+        "INFLUX_BUCKET": "solar",
+        "INFLUX_CONNECT_TIMEOUT": "0.5",
+        "INFLUX_READ_TIMEOUT": "1",
+        "BREAKER_BACKOFF": "1",
+        "START_TIME": "00:00",
+        "END_TIME": "23:59",
+        "LATITUDE": "",
+        "LONGITUDE": "",
+        "STREAM_PORT": "0",
+        "MODBUS_PORT": "0",
+        "HISTORY_DB": "",
+        "LOG_LEVEL": "CRITICAL",
+    })
+
+
+def reset_hosts(enpal):
+    """Fresh host breakers and sessions, so scenarios do not inherit each other's circuit states."""
+    site = enpal.default_site
+    site.host_pool = enpal.HostPool(site.hosts, enpal.BREAKER_FAILURES, enpal.BREAKER_BACKOFF, enpal.BREAKER_MAX_BACKOFF)
+    site.influx_client = enpal.InfluxClient(site.hosts, enpal.INFLUX_TOKEN, enpal.INFLUX_ORG_ID,
+                                            enpal.INFLUX_CONNECT_TIMEOUT, enpal.INFLUX_READ_TIMEOUT, site.host_pool)
+    site.field_cursors = enpal.FieldCursors(enpal.flux_duration_seconds(enpal.QUERY_RANGE_START))
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def bench_cycle(enpal, fakes, args):
+    site = enpal.default_site
+    results = {}
+    for mode in ("combined", "separate"):
+        enpal.FETCH_MODE = mode
+        reset_hosts(enpal)
+        for _ in range(5):  # Discovery and connection setup
+            site.fetch_data()
+        samples = []
+        sent = sum(fake.bytes_sent for fake in fakes)
+        for _ in range(args.cycles):
+            started = time.perf_counter()
+            site.fetch_data()
+            samples.append(time.perf_counter() - started)
+        assert site.current_snapshot.successful, f"{mode} cycles failed"
+        results[mode] = summarize(samples)
+        results[mode]["wire_bytes_per_cycle"] = round((sum(fake.bytes_sent for fake in fakes) - sent) / args.cycles)
+    enpal.FETCH_MODE = "combined"
+    return results
+
+
+class Replay:
+    """Just enough of a streamed response for enpal.iter_response_lines(), replaying a payload in chunks."""
+
+    def __init__(self, payload, encoding):
+        self.headers = {"Content-Encoding": encoding}
+        self.raw = self
+        self.payload = payload
+
+    def stream(self, amt, decode_content=True):
+        for offset in range(0, len(self.payload), amt):
+            yield self.payload[offset:offset + amt]
+
+
+def bench_parse(enpal, fakes, args):
+    fake = fakes[0]
+    request = json.loads(enpal.default_site.combined_query)
+    query = request["query"]
+    points = fake.points(query)
+    legacy_query = re.sub(r" \|> keep\([^)]*\)", "", query)
+    results = {}
+    for label, rendered_query, dialect in (("annotated", legacy_query, None), ("minimal", query, request["dialect"])):
+        payload = fake.render_csv(rendered_query, dialect, points).encode()
+        lines = payload.decode().splitlines()
+        assert len(enpal.parse_influx_csv(lines)) == len(enpal.ALL_FIELDS)
+        seconds = timeit.timeit(lambda: enpal.parse_influx_csv(lines), number=args.iterations) / args.iterations
+        results[label] = {"bytes": len(payload), "us_per_parse": round(seconds * 1e6, 2)}
+
+    payload = gzip.compress(payload, compresslevel=6)
+
+    def parse_gzipped():
+        return enpal.parse_influx_csv(enpal.iter_response_lines(Replay(payload, "gzip"), {"wire": 0, "decoded": 0}))
+
+    assert len(parse_gzipped()) == len(enpal.ALL_FIELDS)
+    seconds = timeit.timeit(parse_gzipped, number=args.iterations) / args.iterations
+    results["minimal_gzip"] = {"bytes": len(payload), "us_per_parse": round(seconds * 1e6, 2)}
+    return results
+
+
+def failover(enpal, fakes, fault, timeout=60):
+    """Break the working host with a fault and time the cycles until one succeeds on another host."""
+    site = enpal.default_site
+    reset_hosts(enpal)
+    for _ in range(3):
+        site.fetch_data()
+    working = site.host_pool.working()
+    fake = next(fake for fake in fakes if fake.address == working)
+    setattr(fake, *fault)
+    started = time.perf_counter()
+    cycles = 0
+    try:
+        while time.perf_counter() - started < timeout:
+            site.fetch_data()
+            cycles += 1
+            host = site.host_pool.working()
+            if site.current_snapshot.successful and host and host != working:
+                return {"seconds": round(time.perf_counter() - started, 3), "cycles": cycles}
+        return {"seconds": None, "cycles": cycles}
+    finally:
+        setattr(fake, fault[0], type(fault[1])())
+
+
+def bench_failover(enpal, fakes, args):
+    return {
+        "reset": failover(enpal, fakes, ("dead", True)),
+        "http_500": failover(enpal, fakes, ("error_rate", 1.0)),
+        "hang": failover(enpal, fakes, ("hang_rate", 1.0)),
+    }
+
+
+def bench_memory(enpal, fakes, args):
+    """Run simulated days of 10 s cycles through history, store, derived values and snapshots."""
+    site = enpal.default_site
+    household = fakes[0].household.__class__(seed=2)
+    clock = [time.time() - args.days * 86400]
+    real_time = enpal.time
+    shim = {name: getattr(time, name) for name in dir(time) if not name.startswith("_")}
+    shim["time"] = lambda: clock[0]
+    enpal.time = types.SimpleNamespace(**shim)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = enpal.HistoryStore(os.path.join(directory, "history.db"), enpal.HISTORY_RETENTION_DAYS)
+        site.history_store = store
+        per_day = []
+        try:
+            tracemalloc.start()
+            for day in range(args.days):
+                for cycle in range(8640):
+                    clock[0] += 10
+                    values = household.advance(clock[0])
+                    solar_generation = {"solar_power_generation": values[enpal.SOLAR_FIELD]}
+                    grid_power = {"grid_power": values[enpal.GRID_EXPORT_FIELD] - values[enpal.GRID_IMPORT_FIELD]}
+                    battery_data = {"battery_charge_discharge": values[enpal.BATTERY_POWER_FIELD],
+                                    "battery_charge_level": values[enpal.BATTERY_LEVEL_FIELD]}
+                    sampled_at, sampled = site.update_history(solar_generation, grid_power, battery_data)
+                    derived = site.derived_values.update(sampled_at, sampled)
+                    site.publish(enpal.Snapshot(solar_generation, grid_power, battery_data, successful=True,
+                                                initialization_phase=False, source_time=clock[0], derived=derived))
+                    if cycle % 6 == 5:
+                        store.flush(state={"fetch_count": cycle})
+                store.compact()
+                per_day.append(tracemalloc.get_traced_memory()[0])
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            enpal.time = real_time
+            site.history_store = None
+            store.connection.close()
+
+    # The first day fills the ring buffers, growth after that is what would accumulate in production
+    steady = [(later - earlier) / 1024 for earlier, later in zip(per_day, per_day[1:])]
+    return {
+        "days": args.days,
+        "after_first_day_kib": round(per_day[0] / 1024, 1),
+        "growth_per_day_kib": round(max(steady), 1) if steady else None,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def bench_endpoint(enpal, fakes, args):
+    import bench_load
+
+    url = bench_load.start_local_server("production", 8)
+    results = {endpoint: [] for endpoint in bench_load.ENDPOINTS}
+    errors = {}
+    deadline = time.monotonic() + args.duration
+    workers = [threading.Thread(target=bench_load.client, args=(url, bench_load.ENDPOINTS, deadline, results, errors, i))
+               for i in range(args.clients)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    report = {}
+    for endpoint, latencies in results.items():
+        latencies.sort()
+        report[endpoint] = {
+            "req_per_s": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(bench_load.percentile(latencies, 0.5) * 1000, 3),
+            "p99_ms": round(bench_load.percentile(latencies, 0.99) * 1000, 3),
+            "errors": errors.get(endpoint, 0),
+        }
+    return report
+
+
+def commit_name():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{sha}-dirty" if dirty else sha
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def compare(previous, current):
+    old = dict(flatten(previous["results"]))
+    print(f"{'metric':48} {previous['commit']:>14} {current['commit']:>14}   change")
+    for key, value in flatten(current["results"]):
+        before = old.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+            print(f"{key:48} {before!s:>14} {value!s:>14}")
+            continue
+        change = (value - before) / abs(before) * 100
+        better = change > 0 if key.endswith(HIGHER_IS_BETTER) else change < 0
+        mark = "" if abs(change) < 5 else (" better" if better else " worse")
+        print(f"{key:48} {before:>14g} {value:>14g} {change:+7.1f}%{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default=",".join(SUITES), help="Comma-separated subset of " + ", ".join(SUITES))
+    parser.add_argument("--cycles", type=int, default=200, help="Measured fetch cycles per mode")
+    parser.add_argument("--iterations", type=int, default=5000, help="Parses per dialect")
+    parser.add_argument("--days", type=int, default=3, help="Simulated days of the memory benchmark")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of the endpoint benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds the fake hosts wait before answering")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="Commit (or result file) to compare this run with")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    # A new point every cycle, so incremental queries always have something to return
+    # Compressed answers like InfluxDB gives to clients sending Accept-Encoding: gzip
+    fakes = [FakeInflux(port=0, latency=args.latency / 1000, gzip=True, point_interval=0.001, seed=seed).start()
+             for seed in (1, 2)]
+    configure([fake.address for fake in fakes])
+    import enpal
+
+    site = enpal.default_site
+    enpal.scheduler.add_job(site.job, site.poll_interval, lambda: None)  # Target of adapt_poll_interval(), never started
+    benchmarks = {"cycle": bench_cycle, "parse": bench_parse, "failover": bench_failover,
+                  "memory": bench_memory, "endpoint": bench_endpoint}
+    results = {}
+    for name in args.only.split(","):
+        started = time.perf_counter()
+        results[name] = benchmarks[name](enpal, fakes, args)
+        print(f"{name:9} {time.perf_counter() - started:6.1f}s  {json.dumps(results[name])}")
+    for fake in fakes:
+        fake.stop()
+
+    run = {
+        "commit": commit_name(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    if not args.no_save:
+        output = args.output or os.path.join(RESULTS_DIR, f"{run['commit']}.json")
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved {output}")
+
+    if args.compare:
+        path = args.compare if os.path.exists(args.compare) else os.path.join(RESULTS_DIR, f"{args.compare}.json")
+        with open(path) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Local stand-in for the InfluxDB query API of the Enpal box.
+
+Usage:
+    python benchmarks/fake_influx.py                                  # one host on 127.0.0.1:8086
+    python benchmarks/fake_influx.py --ports 8086,8087 --latency 40 --error-rate 0.1
+    INFLUX_HOSTS=127.0.0.1:8086,127.0.0.1:8087 START_TIME=00:00 END_TIME=23:59 python enpal.py
+
+Answers POST /api/v2/query with the five Enpal fields. The values follow a
+simulated day (solar curve, house load, battery charging from the surplus and
+discharging at night) and a new point appears every --point-interval seconds,
+so range(start: <time>) queries only see points that are actually newer.
+Responses are annotated CSV unless the request dialect asks for no
+annotations, keep(columns: [...]) is honoured, and --battery-json answers
+Accept: */* battery queries with the numberDataPoints JSON that
+fetch_battery_data() falls back to.
+
+Faults can be injected per host: --latency/--jitter (ms before answering),
+--empty-rate (200 with an empty body), --error-rate (HTTP 500), --hang-rate
+(never answer) and --dead (reset every connection). The benchmarks use the
+same class in-process: FakeInflux(port=0, ...).start(), with the fault
+attributes changeable while it runs.
+"""
+import argparse
+import gzip
+import http.server
+import json
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+FIELDS = [
+    "Power.Production.Total",
+    "Power.Grid.Export",
+    "Power.Grid.Import",
+    "Power.Battery.Charge.Discharge",
+    "Percent.Storage.Level",
+]
+BATTERY_FIELDS = ["Power.Battery.Charge.Discharge", "Percent.Storage.Level"]
+COLUMNS = ["_start", "_stop", "_time", "_value", "_field", "_measurement"]
+DATATYPES = {"_start": "dateTime:RFC3339", "_stop": "dateTime:RFC3339", "_time": "dateTime:RFC3339",
+             "_value": "double", "_field": "string", "_measurement": "string"}
+GROUPED = {"_start", "_stop", "_field", "_measurement"}
+
+
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Household:
+    """Deterministic simulated PV system, advanced in fixed steps."""
+
+    def __init__(self, peak=8000.0, capacity_wh=10000.0, seed=1):
+        self.peak = peak
+        self.capacity_wh = capacity_wh
+        self.level = 50.0
+        self.random = random.Random(seed)
+        self.time = None
+        self.values = {}
+
+    def advance(self, timestamp):
+        """Return the field values of the point at timestamp (epoch seconds)."""
+        if timestamp == self.time:
+            return self.values
+        elapsed = 0.0 if self.time is None else max(timestamp - self.time, 0.0)
+        self.time = timestamp
+
+        hour = (timestamp % 86400) / 3600
+        daylight = max(0.0, math.sin(math.pi * (hour - 6) / 14)) if 6 <= hour <= 20 else 0.0
+        clouds = 0.75 + 0.25 * self.random.random()
+        solar = round(self.peak * daylight ** 1.5 * clouds, 1)
+        load = 350 + self.random.gauss(0, 40) + (2500 if self.random.random() < 0.03 else 0)
+
+        surplus = solar - load
+        if surplus > 0 and self.level < 100:
+            battery = min(surplus, 3000.0)
+        elif surplus < 0 and self.level > 5:
+            battery = max(surplus, -3000.0)
+        else:
+            battery = 0.0
+        self.level = min(100.0, max(0.0, self.level + battery * elapsed / 3600 / self.capacity_wh * 100))
+        grid = surplus - battery
+
+        self.values = {
+            "Power.Production.Total": solar,
+            "Power.Grid.Export": round(max(grid, 0.0), 1),
+            "Power.Grid.Import": round(max(-grid, 0.0), 1),
+            "Power.Battery.Charge.Discharge": round(battery, 1),
+            "Percent.Storage.Level": round(self.level, 1),
+        }
+        return self.values
+
+
+class FakeInflux:
+    """One simulated InfluxDB host with injectable faults."""
+
+    def __init__(self, host="127.0.0.1", port=8086, latency=0.0, jitter=0.0, empty_rate=0.0, error_rate=0.0,
+                 hang_rate=0.0, dead=False, battery_json=False, gzip=False, point_interval=10.0, seed=1):
+        self.latency = latency  # Seconds
+        self.jitter = jitter
+        self.empty_rate = empty_rate
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.dead = dead
+        self.battery_json = battery_json
+        self.gzip = gzip
+        self.point_interval = point_interval
+        self.household = Household(seed=seed)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {"ok": 0, "empty": 0, "error": 0, "hang": 0, "dead": 0}
+        self.bytes_sent = 0
+        self.stopped = threading.Event()
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=f"fake-influx-{self.address}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()  # Releases hanging requests
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, outcome, sent=0):
+        with self.lock:
+            self.requests[outcome] += 1
+            self.bytes_sent += sent
+
+    def outcome(self):
+        """Pick the fault (or success) for the next request."""
+        with self.lock:
+            roll = self.random.random()
+        for name, rate in (("hang", self.hang_rate), ("error", self.error_rate), ("empty", self.empty_rate)):
+            if roll < rate:
+                return name
+            roll -= rate
+        return "ok"
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+        return self.latency + extra
+
+    def points(self, query):
+        """Return [(time, field, value)] answering a Flux query of enpal.py."""
+        latest = math.floor(time.time() / self.point_interval) * self.point_interval
+        with self.lock:
+            values = self.household.advance(latest)
+        fields = re.findall(r'r\._field == "([^"]+)"', query) or FIELDS
+        if "limit(n:1)" in query:
+            fields = fields[:1]
+        start = re.search(r"range\(start: ([^,)]+)", query)
+        if start and not start.group(1).startswith("-"):
+            requested = datetime.fromisoformat(re.sub(r"\.\d+", "", start.group(1)).replace("Z", "+00:00")).timestamp()
+            if requested > latest:
+                return []
+        return [(latest, field, values[field]) for field in fields if field in values]
+
+    def render_csv(self, query, dialect, points):
+        if not points:
+            return "\r\n"
+        keep = re.search(r"keep\(columns: \[([^\]]*)\]\)", query)
+        columns = [column.strip().strip('"') for column in keep.group(1).split(",")] if keep else COLUMNS
+        annotations = dialect.get("annotations", ["datatype", "group", "default"]) if dialect else ["datatype", "group", "default"]
+        lines = []
+        if "datatype" in annotations:
+            lines.append(",".join(["#datatype", "string", "long"] + [DATATYPES.get(column, "string") for column in columns]))
+        if "group" in annotations:
+            lines.append(",".join(["#group", "false", "false"] + ["true" if column in GROUPED else "false" for column in columns]))
+        if "default" in annotations:
+            lines.append(",".join(["#default", "_result", ""] + [""] * len(columns)))
+        lines.append(",".join(["", "result", "table"] + columns))
+        start = rfc3339(points[0][0] - 300)
+        for table, (timestamp, field, value) in enumerate(points):
+            row = {"_start": start, "_stop": rfc3339(time.time()), "_time": rfc3339(timestamp),
+                   "_value": repr(float(value)), "_field": field, "_measurement": "inverter"}
+            lines.append(",".join(["", "", str(table)] + [row.get(column, "") for column in columns]))
+        return "\r\n".join(lines) + "\r\n\r\n"
+
+    def respond(self, body, accept):
+        """Return (status, content type, payload) for a request body."""
+        request = json.loads(body)
+        query = request.get("query", "")
+        points = self.points(query)
+        fields = {field for _, field, _ in points}
+        if self.battery_json and accept == "*/*" and fields and fields <= set(BATTERY_FIELDS):
+            payload = {"numberDataPoints": {field: {"value": value, "time": rfc3339(timestamp)}
+                                            for timestamp, field, value in points}}
+            return 200, "application/json", json.dumps(payload)
+        return 200, "text/csv; charset=utf-8", self.render_csv(query, request.get("dialect"), points)
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes, delayed ACKs would add 40 ms
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if fake.dead:
+            # Checked per request, keep-alive connections die as well. Closing with SO_LINGER 0 sends a reset.
+            fake.count("dead")
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+            return
+        outcome = fake.outcome()
+        delay = fake.delay()
+        if delay:
+            time.sleep(delay)
+
+        if outcome == "hang":
+            fake.count("hang")
+            fake.stopped.wait()
+            return
+        if outcome == "error":
+            payload, status, content_type = b'{"code":"internal error","message":"injected failure"}', 500, "application/json"
+        elif outcome == "empty":
+            payload, status, content_type = b"", 200, "text/csv; charset=utf-8"
+        else:
+            status, content_type, text = fake.respond(body, self.headers.get("Accept", "application/csv"))
+            payload = text.encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if fake.gzip and "gzip" in self.headers.get("Accept-Encoding", "") and payload:
+            payload = gzip.compress(payload, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        fake.count(outcome, len(payload))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ports", default="8086", help="Comma-separated ports, one simulated host each")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds before every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra milliseconds up to this value")
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--dead", default="", help="Comma-separated ports that reset every connection")
+    parser.add_argument("--battery-json", action="store_true")
+    parser.add_argument("--gzip", action="store_true", help="Compress answers when the client accepts gzip")
+    parser.add_argument("--point-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    dead = {int(port) for port in args.dead.split(",") if port}
+    fakes = []
+    for port in (int(port) for port in args.ports.split(",")):
+        fakes.append(FakeInflux(args.host, port, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                empty_rate=args.empty_rate, error_rate=args.error_rate, hang_rate=args.hang_rate,
+                                dead=port in dead, battery_json=args.battery_json, gzip=args.gzip,
+                                point_interval=args.point_interval).start())
+        print(f"Fake InfluxDB on {fakes[-1].address}{' (dead)' if port in dead else ''}")
+    print(f"INFLUX_HOSTS={','.join(fake.address for fake in fakes)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for fake in fakes:
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
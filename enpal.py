@@ -1,28 +1,135 @@
 import os
+import math
 import time
+import random
+import signal
+import socket
+import selectors
+import json
+import re
+import hashlib
+import struct
+import zlib
 import requests
-import pandas as pd
-from io import StringIO
+from requests.adapters import HTTPAdapter
+import csv
+import sqlite3
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
 import logging
-from flask import Flask, jsonify
+import atexit
+import queue
+import copy
+from logging.handlers import QueueHandler, QueueListener
+from flask import Flask, jsonify, request, g, Response, redirect
 from dotenv import load_dotenv
-from threading import Timer
+from threading import Thread, Lock, Condition, Event
 from datetime import datetime, timedelta
 import pytz
-from itertools import cycle
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from functools import lru_cache, wraps
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging to log to stdout and stderr
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # Level until the initialization phase ends, then WARNING unless DEBUG
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 60))  # Seconds per rate limit window of a log statement
+LOG_BURST = int(os.getenv("LOG_BURST", 5))  # Records per window a log statement may emit before sampling starts
+LOG_SAMPLE = int(os.getenv("LOG_SAMPLE", 100))  # Beyond the burst, emit every n-th record only
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+class LogQueueHandler(QueueHandler):
+    """Queue records with their message rendered and the traceback kept apart.
+
+    QueueHandler.prepare() appends the traceback to the message, so the output
+    handler would find no exception left to format. Here the traceback goes to
+    exc_text, which both the JSON and the text formatter print on their own.
+    """
+
+    def prepare(self, record):
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+class RateLimitFilter(logging.Filter):
+    """Limit how often a single log statement emits records.
+
+    Records are grouped by their call site, so f-string messages with changing
+    values count as one message. Each call site may emit `burst` records per
+    `period` seconds; beyond that only every `sample`-th record passes. A record
+    that passes after drops carries their number as `suppressed`.
+    """
+
+    def __init__(self, period, burst, sample):
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        self.sample = max(sample, 1)
+        self.sites = {}  # (pathname, lineno) -> [window start, records in window, dropped since last emitted]
+        self.lock = Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [now, 0, 0]
+            elif now - site[0] >= self.period:
+                site[0], site[1] = now, 0
+            site[1] += 1
+            if site[1] <= self.burst or (site[1] - self.burst) % self.sample == 0:
+                record.suppressed, site[2] = site[2], 0
+                return True
+            site[2] += 1
+            return False
+
+# Records are handed to a queue and written by a background thread, so logging never blocks on stdout
+log_queue = queue.SimpleQueue()
+queue_handler = LogQueueHandler(log_queue)
+queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_BURST, LOG_SAMPLE))
+output_handler = logging.StreamHandler()
+output_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_listener = QueueListener(log_queue, output_handler)
+logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), handlers=[queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Read environment variables
+SITES_CONFIG = os.getenv("SITES_CONFIG", "")  # JSON file with further Enpal installations polled by this process
 INFLUX_HOSTS = os.getenv("INFLUX_HOSTS")
-logging.info(f"INFLUX_HOSTS: {INFLUX_HOSTS}")
 
 if INFLUX_HOSTS:
-    INFLUX_HOSTS = INFLUX_HOSTS.split(",")  # Multiple IPs separated by commas
+    INFLUX_HOSTS = [host.strip() for host in INFLUX_HOSTS.split(",") if host.strip()]  # Multiple IPs separated by commas, each optionally with :port
+elif SITES_CONFIG:
+    INFLUX_HOSTS = []  # All sites come from SITES_CONFIG
 else:
     logging.error("INFLUX_HOSTS environment variable is not set or empty.")
     raise ValueError("INFLUX_HOSTS environment variable is not set or empty.")
@@ -36,44 +143,688 @@ HTTP_PORT = int(os.getenv("HTTP_PORT", 5000))
 START_TIME = os.getenv("START_TIME", "05:00")  
 END_TIME = os.getenv("END_TIME", "22:00")  
 TIMEZONE = os.getenv("TIMEZONE", "CET")  
+FETCH_MODE = os.getenv("FETCH_MODE", "combined")  # "combined" (one query per cycle) or "separate"
+INFLUX_CONNECT_TIMEOUT = float(os.getenv("INFLUX_CONNECT_TIMEOUT", 3))  # Seconds to establish a connection
+INFLUX_READ_TIMEOUT = float(os.getenv("INFLUX_READ_TIMEOUT", 10))  # Seconds to wait for a response
+INFLUX_COMPRESSION = os.getenv("INFLUX_COMPRESSION", "gzip")  # "gzip" (compressed responses) or "identity"
+DISCOVERY_MODE = os.getenv("DISCOVERY_MODE", "concurrent")  # "concurrent" (probe all hosts at once) or "sequential"
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 3))  # Failed requests in a row that open a host's circuit
+BREAKER_BACKOFF = float(os.getenv("BREAKER_BACKOFF", 10))  # Seconds an opened circuit waits before the first trial
+BREAKER_MAX_BACKOFF = float(os.getenv("BREAKER_MAX_BACKOFF", 600))  # Upper limit of the doubling backoff
+FETCH_INTERVAL = float(os.getenv("FETCH_INTERVAL", 10))  # Seconds between fetch cycles until the values show how fast they change
+FETCH_JITTER = float(os.getenv("FETCH_JITTER", 0))  # Maximum random delay in seconds added to each cycle
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 4))  # Threads running the fetch cycles, shared by all sites
+POLL_INTERVAL_MIN = float(os.getenv("POLL_INTERVAL_MIN", min(5.0, FETCH_INTERVAL)))  # Seconds between cycles while values change
+POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", 3 * FETCH_INTERVAL))  # Longest interval while values are flat
+POLL_CHANGE_THRESHOLD = float(os.getenv("POLL_CHANGE_THRESHOLD", 100))  # Watts of grid/battery change that count as changing
+LATITUDE = os.getenv("LATITUDE", "")  # With LONGITUDE: follow sunrise/sunset instead of START_TIME/END_TIME
+LONGITUDE = os.getenv("LONGITUDE", "")
+SUN_MARGIN = float(os.getenv("SUN_MARGIN", 60))  # Minutes polled before sunrise and after sunset
+HISTORY_DEPTH = int(os.getenv("HISTORY_DEPTH", 8640))  # Samples kept per meter value (8640 = one day at 10 s)
+STUCK_WINDOW = int(os.getenv("STUCK_WINDOW", 60))  # Samples per value watched by the anomaly detection
+ANOMALY_MAX_POWER = float(os.getenv("ANOMALY_MAX_POWER", 30000))  # Watts beyond which a power value is implausible
+ANOMALY_MAX_SOC_RATE = float(os.getenv("ANOMALY_MAX_SOC_RATE", 100))  # Fastest plausible battery level change in %/h
+STREAM_PORT = int(os.getenv("STREAM_PORT", HTTP_PORT + 1))  # Port of the Server-Sent Events stream, 0 disables it
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 15))  # Seconds without a new snapshot before a heartbeat is sent
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", 100))  # Maximum number of concurrent stream subscribers
+MODBUS_PORT = int(os.getenv("MODBUS_PORT", 0))  # Port of the Modbus TCP server (usually 502), 0 disables it
+MODBUS_MAX_CLIENTS = int(os.getenv("MODBUS_MAX_CLIENTS", 64))  # Maximum number of concurrent Modbus masters
+DERIVED_EMA_SECONDS = float(os.getenv("DERIVED_EMA_SECONDS", 60))  # Time constant of the smoothed grid and solar power
+DERIVED_SOC_WINDOW = float(os.getenv("DERIVED_SOC_WINDOW", 900))  # Seconds over which the battery SoC rate is measured
+DERIVED_MAX_GAP = float(os.getenv("DERIVED_MAX_GAP", 300))  # Longer gaps between samples are not integrated into energy totals
+REFRESH_MIN_AGE = float(os.getenv("REFRESH_MIN_AGE", 2))  # Values younger than this are never refreshed on demand
+HISTORY_DB = os.getenv("HISTORY_DB", "data/history.db")  # SQLite file for warm restarts, empty disables it
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 7))  # Days of samples kept on disk
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 60))  # Seconds between batched writes (and fsyncs)
+SUPERVISOR_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", 10))  # Seconds between checks of the fetch loops, 0 disables the supervisor
+SUPERVISOR_FAILURES = int(os.getenv("SUPERVISOR_FAILURES", 3))  # Failed fetch cycles in a row that start a recovery
+SUPERVISOR_STALL = float(os.getenv("SUPERVISOR_STALL", 120))  # Seconds without a finished fetch cycle before the loop counts as stalled
+SERVER_MODE = os.getenv("SERVER_MODE", "production")  # "production" (waitress) or "development" (Flask dev server)
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", 8))  # Worker threads of the production server
+
+# InfluxDB fields read by this service
+SOLAR_FIELD = "Power.Production.Total"
+GRID_EXPORT_FIELD = "Power.Grid.Export"
+GRID_IMPORT_FIELD = "Power.Grid.Import"
+BATTERY_POWER_FIELD = "Power.Battery.Charge.Discharge"
+BATTERY_LEVEL_FIELD = "Percent.Storage.Level"
+ALL_FIELDS = [SOLAR_FIELD, GRID_EXPORT_FIELD, GRID_IMPORT_FIELD, BATTERY_POWER_FIELD, BATTERY_LEVEL_FIELD]
+
+class RingBuffer:
+    """Fixed-capacity history of (timestamp, value) samples in preallocated float64 arrays.
+
+    Appending is O(1). Every sample is written twice, at slot i and i + capacity,
+    so the latest n samples are always contiguous and window() can hand them out
+    as zero-copy memoryviews. The views read the live storage: use them right away
+    instead of keeping them around.
+    """
 
-# Cycle through the IP addresses
-influx_hosts_cycle = cycle(INFLUX_HOSTS)
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(16 * capacity))
+        self.values = array('d', bytes(16 * capacity))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        """Store a sample, overwriting the oldest one once the buffer is full."""
+        head = self.head
+        self.timestamps[head] = self.timestamps[head + self.capacity] = timestamp
+        self.values[head] = self.values[head + self.capacity] = value
+        self.head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def window(self, n=None):
+        """Return (timestamps, values) memoryviews of the latest n samples, oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        end = self.head + self.capacity
+        return memoryview(self.timestamps)[end - n:end], memoryview(self.values)[end - n:end]
+
+    def since(self, timestamp):
+        """Return (timestamps, values) memoryviews of all samples not older than timestamp."""
+        timestamps, values = self.window()
+        start = bisect_left(timestamps, timestamp)
+        return timestamps[start:], values[start:]
+
+    def last(self):
+        """Return the latest (timestamp, value) sample, or None if the buffer is empty."""
+        if not self.count:
+            return None
+        index = self.head + self.capacity - 1
+        return self.timestamps[index], self.values[index]
+
+# Meter values with a history, one ring buffer per value and site
+HISTORY_KEYS = ["solar_power_generation", "grid_power", "battery_charge_discharge", "battery_charge_level"]
+
+class HistoryStore:
+    """SQLite (WAL mode) store of the meter history for warm restarts.
+
+    Samples are queued in memory by record() and written by flush() in one
+    transaction, so there is at most one fsync per flush interval and a crash
+    loses at most that interval. compact() drops samples past the retention and
+    returns the freed pages to the file system.
+    """
 
-# Global variables to store the cached data and health status
-cached_solar_generation = None
-cached_grid_power = None
-cached_battery_data = None
-data_fetch_successful = False
+    def __init__(self, path, retention_days):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.retention = retention_days * 86400
+        self.pending = []
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Only effective on a new file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS samples (field TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL, "
+                                "PRIMARY KEY (field, ts)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def record(self, timestamp, values):
+        """Queue the values of one cycle for the next flush."""
+        with self.lock:
+            self.pending.extend((field, timestamp, value) for field, value in values.items())
+
+    def flush(self, state=None):
+        """Write all queued samples and the given state in a single transaction."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending and not state:
+                return 0
+            try:
+                with self.connection:
+                    self.connection.execute("BEGIN")
+                    self.connection.executemany("INSERT OR REPLACE INTO samples (field, ts, value) VALUES (?, ?, ?)", pending)
+                    if state:
+                        self.connection.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                                    [(key, json.dumps(value)) for key, value in state.items()])
+            except sqlite3.Error as e:
+                logging.error(f"Writing history failed: {e}")
+                self.pending = pending + self.pending
+                return 0
+            return len(pending)
+
+    def load(self, field, limit, since=None):
+        """Return up to limit of the newest (ts, value) rows of a field, oldest first."""
+        since = time.time() - self.retention if since is None else since
+        with self.lock:
+            rows = self.connection.execute("SELECT ts, value FROM samples WHERE field = ? AND ts >= ? ORDER BY ts DESC LIMIT ?",
+                                           (field, since, limit)).fetchall()
+        rows.reverse()
+        return rows
+
+    def range(self, field, start, end):
+        """Return (timestamps, values) lists of all samples of a field between start and end."""
+        with self.lock:
+            rows = self.connection.execute("SELECT ts, value FROM samples WHERE field = ? AND ts >= ? AND ts <= ? ORDER BY ts",
+                                           (field, start, end)).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def load_state(self):
+        with self.lock:
+            return {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM state")}
+
+    def compact(self):
+        """Delete samples older than the retention and release the freed pages."""
+        with self.lock:
+            try:
+                deleted = self.connection.execute("DELETE FROM samples WHERE ts < ?", (time.time() - self.retention,)).rowcount
+                self.connection.execute("PRAGMA incremental_vacuum")
+                self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logging.error(f"Compacting history failed: {e}")
+                return 0
+        if deleted:
+            logging.info(f"Removed {deleted} samples past the retention of {self.retention / 86400:g} days.")
+        return deleted
+
+# All metrics exposed on /metrics, in registration order
+metrics_registry = []
+
+def format_labels(labelnames, labelvalues, extra=""):
+    """Render a Prometheus label set like {host="10.0.0.2",le="0.5"}."""
+    pairs = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+             for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """Base class of the in-process Prometheus metrics.
+
+    Updates only take a lock and touch a dict, so the metrics can stay enabled on
+    the fetch hot path permanently.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback  # Returns {labelvalues tuple: value} at scrape time
+        self.values = {}
+        self.lock = Lock()
+        metrics_registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        if self.callback:
+            return self.callback().items()
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in self.samples():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, clock=time.monotonic, **labels):
+        """Observe the duration of a with block in seconds, measured with clock (e.g. time.thread_time for CPU time)."""
+        started = clock()
+        try:
+            yield
+        finally:
+            self.observe(clock() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series_list = [(key, list(series["counts"]), series["sum"], series["count"]) for key, series in self.values.items()]
+        for labelvalues, counts, total, observations in series_list:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = format_labels(self.labelnames, labelvalues, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labelvalues)} {observations}")
+        return lines
+
+def render_metrics():
+    """Render all registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+FETCH_PHASE_SECONDS = Histogram("enpal_fetch_phase_seconds", "Duration of the fetch cycle phases (probe, http, parse, total).", ["site", "phase"])
+INFLUX_REQUEST_SECONDS = Histogram("enpal_influx_request_seconds", "Latency of InfluxDB requests until the response headers arrived.", ["host"])
+INFLUX_REQUEST_ERRORS = Counter("enpal_influx_request_errors_total", "InfluxDB requests that failed or returned a non-200 status.", ["host"])
+INFLUX_QUERIES = Counter("enpal_influx_queries_total", "InfluxDB data queries by range (cursor or window).", ["site", "range"])
+INFLUX_RESPONSE_BYTES = Histogram("enpal_influx_response_bytes", "Bytes received on the wire per InfluxDB query response.", ["query"],
+                                  buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144))
+INFLUX_DECODED_BYTES = Histogram("enpal_influx_decoded_bytes", "Bytes per InfluxDB query response after decompression.", ["query"],
+                                 buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144))
+INFLUX_PARSE_SECONDS = Histogram("enpal_influx_parse_cpu_seconds", "CPU time spent decompressing and parsing a query response.", ["query"],
+                                 buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1))
+FETCH_CYCLES = Counter("enpal_fetch_cycles_total", "Fetch cycles by result (ok, failed, no_host).", ["site", "result"])
+HTTP_REQUESTS = Counter("enpal_http_requests_total", "Requests served by the HTTP endpoints.", ["endpoint", "status"])
+HTTP_REQUEST_SECONDS = Histogram("enpal_http_request_seconds", "Latency of the HTTP endpoints.", ["endpoint"],
+                                 buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+def observe_response_bytes(query_name, response):
+    """Record the size of a fully read response as it came over the wire and after decompression."""
+    try:
+        received = response.raw.tell()
+    except Exception:
+        received = len(response.content)
+    INFLUX_RESPONSE_BYTES.observe(received, query=query_name)
+    INFLUX_DECODED_BYTES.observe(len(response.content), query=query_name)
+
+def iter_response_lines(response, sizes):
+    """Yield the text lines of a streamed response, decompressing a gzip body chunk by chunk.
+
+    Only the undecoded chunks are read from the connection, so sizes["wire"]
+    counts the bytes as received and sizes["decoded"] the bytes after
+    decompression. Lines are split before they are decoded, a UTF-8 character
+    cut by a chunk boundary stays intact.
+    """
+    encoding = response.headers.get("Content-Encoding", "identity").lower()
+    if encoding not in ("gzip", "identity"):
+        raise InfluxQueryError(f"Unsupported Content-Encoding {encoding}")
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+
+    def chunks():
+        for chunk in response.raw.stream(16384, decode_content=False):
+            sizes["wire"] += len(chunk)
+            yield decompressor.decompress(chunk) if decompressor else chunk
+        if decompressor:
+            yield decompressor.flush()
+
+    pending = b""
+    for chunk in chunks():
+        sizes["decoded"] += len(chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode()
+    if pending:
+        yield pending.decode()
+
+def influx_address(host):
+    """host or host:port from INFLUX_HOSTS as host:port, with InfluxDB's default port 8086."""
+    if host.startswith("["):
+        return host if "]:" in host else f"{host}:8086"
+    if host.count(":") > 1:
+        return f"[{host}]:8086"  # Bare IPv6 address
+    return host if ":" in host else f"{host}:8086"
+
+class InfluxClient:
+    """Pooled keep-alive access to the InfluxDB query API on the Enpal box.
+
+    Keeps one requests.Session per host so consecutive queries reuse the TCP
+    connection, applies connect/read timeouts to every request and records the
+    request latency per host.
+    """
 
-# Global variable to store the last known working IP
-last_working_ip = None
+    def __init__(self, hosts, token, org_id, connect_timeout, read_timeout, host_pool=None, compression=INFLUX_COMPRESSION):
+        self.hosts = list(hosts)
+        self.host_pool = host_pool
+        self.timeout = (connect_timeout, read_timeout)
+        self.urls = {host: f"http://{influx_address(host)}/api/v2/query?orgID={org_id}" for host in self.hosts}
+        self.headers = {
+            "application/csv": {
+                "Authorization": f"Token {token}",
+                "Accept": "application/csv",
+                "Accept-Encoding": compression,
+                "Content-type": "application/json"
+            },
+            "*/*": {
+                "Authorization": f"Token {token}",
+                "Accept": "*/*",
+                "Accept-Encoding": compression,
+                "Content-type": "application/json"
+            }
+        }
+        self.sessions = {}
+        self.latency = {host: {"requests": 0, "errors": 0, "total_seconds": 0.0, "last_seconds": None, "max_seconds": 0.0}
+                        for host in self.hosts}
+        self.lock = Lock()
+
+    def session(self, host):
+        """Return the keep-alive session for a host, creating it on first use."""
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+                session.mount("http://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def query(self, host, body, accept="application/csv", stream=False):
+        """POST a prebuilt query body to a host and return the response.
+
+        With stream=True the body is left unread so it can be parsed while it
+        arrives; the caller must consume or close the response.
+        """
+        started = time.monotonic()
+        try:
+            response = self.session(host).post(self.urls[host], headers=self.headers[accept], data=body,
+                                               timeout=self.timeout, stream=stream)
+        except requests.exceptions.RequestException as e:
+            self.record(host, time.monotonic() - started, error=True, reason=type(e).__name__)
+            raise
+        self.record(host, time.monotonic() - started, error=response.status_code != 200, reason=f"HTTP {response.status_code}")
+        return response
+
+    def record(self, host, seconds, error=False, reason=None):
+        """Update the latency counter and the circuit breaker of a host."""
+        if self.host_pool:
+            self.host_pool.record(host, seconds, error=reason if error else None)
+        INFLUX_REQUEST_SECONDS.observe(seconds, host=host)
+        if error:
+            INFLUX_REQUEST_ERRORS.inc(host=host)
+        with self.lock:
+            stats = self.latency[host]
+            stats["requests"] += 1
+            stats["total_seconds"] += seconds
+            stats["last_seconds"] = seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if error:
+                stats["errors"] += 1
+
+    def reset(self):
+        """Close all pooled connections, e.g. after the box rebooted."""
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def stats(self):
+        """Return a copy of the per-host latency counters including the average."""
+        with self.lock:
+            result = {}
+            for host, stats in self.latency.items():
+                result[host] = dict(stats)
+                result[host]["avg_seconds"] = stats["total_seconds"] / stats["requests"] if stats["requests"] else None
+            return result
+
+class InfluxQueryError(Exception):
+    """Raised when InfluxDB answers a query with an error table."""
+
+# Annotated CSV datatypes that carry numeric values
+NUMERIC_DATATYPES = {"double", "long", "unsignedLong"}
+
+def parse_influx_csv(lines):
+    """Parse an InfluxDB CSV response in a single pass.
+
+    Accepts any iterable of text lines, so a streamed response can be parsed
+    while it arrives. Handles multiple tables (each with its own header row),
+    the optional #datatype/#default annotations and error tables. Returns a
+    {field: (time, value)} map holding the last row seen for every _field.
+    """
+    result = {}
+    header = None
+    error_index = field_index = value_index = time_index = None
+    datatypes = None
+    defaults = None
+    for row in csv.reader(lines):
+        if not row or not any(row):
+            # A blank line ends the current table, the next one brings its own header
+            header = datatypes = defaults = None
+            continue
 
-# Global variable to track if no working IP was found
-no_working_ip_found = False
+        if row[0].startswith("#"):
+            if row[0] == "#datatype":
+                datatypes = row
+            elif row[0] == "#default":
+                defaults = row
+            header = None
+            continue
 
-# Global variables to store the last 10 values and their timestamps
-solar_generation_history = []
-grid_power_history = []
-battery_data_history = []
-fetch_timestamps = []
+        if header is None:
+            header = row
+            error_index = header.index("error") if "error" in header and "_value" not in header else None
+            try:
+                field_index = header.index("_field")
+                value_index = header.index("_value")
+            except ValueError:
+                # Not a field table (e.g. the connectivity probe), skip it
+                field_index = value_index = None
+            time_index = header.index("_time") if "_time" in header else None
+            continue
 
-# Global variable to track the initialization phase
-initialization_phase = True
+        if error_index is not None:
+            raise InfluxQueryError(row[error_index] if len(row) > error_index else "InfluxDB returned an error table")
 
-# Global variable to track the number of data fetches
-fetch_count = 0
+        if field_index is None or len(row) <= max(field_index, value_index):
+            continue
 
-def get_influx_api():
-    """Get the next INFLUX_API URL from the cycle of IP addresses."""
-    global last_working_ip
-    if last_working_ip:
-        return f"http://{last_working_ip}:8086/api/v2/query?orgID={INFLUX_ORG_ID}"
-    else:
-        current_host = next(influx_hosts_cycle)
-        return f"http://{current_host}:8086/api/v2/query?orgID={INFLUX_ORG_ID}"
+        field = row[field_index] or (defaults[field_index] if defaults else "")
+        value = row[value_index] or (defaults[value_index] if defaults else "")
+        if datatypes and datatypes[value_index] not in NUMERIC_DATATYPES:
+            if datatypes[value_index] == "boolean":
+                value = 1.0 if value == "true" else 0.0
+            else:
+                continue
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                # Repeated header row of a table without annotations
+                continue
+        result[field] = (row[time_index] if time_index is not None else None, value)
+    return result
+
+def parse_influx_time(value):
+    """Convert an RFC3339 timestamp from InfluxDB (up to nanosecond precision) to epoch seconds."""
+    value = value.replace("Z", "+00:00")
+    if "." in value:
+        # datetime only handles microseconds, cut the fraction to six digits
+        head, _, rest = value.partition(".")
+        digits = len(rest) - len(rest.lstrip("0123456789"))
+        value = f"{head}.{rest[:min(digits, 6)].ljust(6, '0')}{rest[digits:]}"
+    return datetime.fromisoformat(value).timestamp()
+
+class HostPool:
+    """Circuit breaker and rolling health score per InfluxDB host.
+
+    A host is closed (in use) until BREAKER_FAILURES requests in a row failed.
+    It is then open and skipped for a backoff that doubles with every failed
+    trial, with jitter and up to BREAKER_MAX_BACKOFF. Once the backoff expired
+    the host is half-open: the next request is a trial that closes the circuit
+    again or reopens it. Usable hosts without failures since their last success
+    come first, then the rolling success rate and latency decide the order.
+    """
+    SCORE_WEIGHT = 0.2  # Weight of the newest result in the rolling success rate and latency
+
+    def __init__(self, hosts, failures, backoff, max_backoff):
+        self.threshold = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breakers = {host: {"state": "closed", "failures": 0, "trips": 0, "retry_at": 0.0, "score": 0.5,
+                                "latency": None, "successes": 0, "last_error": None} for host in hosts}
+        self.lock = Lock()
+
+    def record(self, host, seconds, error=None):
+        """Feed the result of a request into the breaker of a host; error is a short reason or None."""
+        with self.lock:
+            breaker = self.breakers[host]
+            breaker["score"] += self.SCORE_WEIGHT * ((0.0 if error else 1.0) - breaker["score"])
+            if error is None:
+                latency = breaker["latency"]
+                breaker["latency"] = seconds if latency is None else latency + self.SCORE_WEIGHT * (seconds - latency)
+                if breaker["state"] != "closed":
+                    logging.warning(f"Circuit for {host} closed again.")
+                breaker.update(state="closed", failures=0, trips=0, successes=breaker["successes"] + 1)
+                return
+
+            breaker["failures"] += 1
+            breaker["last_error"] = error
+            if breaker["state"] == "half_open" or (breaker["state"] == "closed" and breaker["failures"] >= self.threshold):
+                delay = min(self.backoff * 2 ** breaker["trips"], self.max_backoff)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                breaker["trips"] += 1
+                breaker["state"] = "open"
+                breaker["retry_at"] = time.monotonic() + delay
+                logging.warning(f"Circuit for {host} opened after {breaker['failures']} failures ({error}), "
+                                f"next trial in {delay:.0f}s.")
+
+    def candidates(self):
+        """Return the usable hosts, best first. Open hosts whose backoff expired turn half-open."""
+        now = time.monotonic()
+        with self.lock:
+            usable = []
+            for host, breaker in self.breakers.items():
+                if breaker["state"] == "open":
+                    if now < breaker["retry_at"]:
+                        continue
+                    breaker["state"] = "half_open"
+                usable.append(host)
+            return sorted(usable, key=lambda host: (self.breakers[host]["failures"] > 0, -self.breakers[host]["score"],
+                                                    self.breakers[host]["latency"] if self.breakers[host]["latency"] is not None else float("inf")))
+
+    def working(self):
+        """Return the best host if it answered before and has not failed since, else None."""
+        for host in self.candidates()[:1]:
+            breaker = self.breakers[host]
+            if breaker["state"] == "closed" and breaker["successes"] and not breaker["failures"]:
+                return host
+        return None
+
+    def down(self):
+        """True while the circuits of all hosts are open, i.e. the Enpal box seems down."""
+        now = time.monotonic()
+        with self.lock:
+            return all(breaker["state"] == "open" and now < breaker["retry_at"] for breaker in self.breakers.values())
+
+    def summary(self):
+        """Return the circuit state of every host."""
+        with self.lock:
+            return {host: breaker["state"] for host, breaker in self.breakers.items()}
+
+    def stats(self):
+        """Return a copy of every breaker including the seconds until the next trial."""
+        now = time.monotonic()
+        with self.lock:
+            result = {}
+            for host, breaker in self.breakers.items():
+                result[host] = {key: value for key, value in breaker.items() if key != "retry_at"}
+                result[host]["score"] = round(breaker["score"], 3)
+                result[host]["retry_in"] = round(max(0.0, breaker["retry_at"] - now), 1) if breaker["state"] == "open" else None
+            return result
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+# CSV without the #datatype/#group/#default annotation rows, the parser does not need them
+QUERY_DIALECT = {"header": True, "delimiter": ",", "annotations": []}
+
+# The only columns the parser reads, everything else (_start, _stop, _measurement, tags) is dropped by the box
+QUERY_COLUMNS = '["_time", "_field", "_value"]'
+
+def build_query(flux, org_id):
+    """Build the JSON request body for a Flux query once, so it can be reused every cycle."""
+    return json.dumps({"type": "flux", "query": flux, "orgID": org_id, "dialect": QUERY_DIALECT}).encode()
+
+def field_filter(fields):
+    """Build the Flux filter predicate selecting the given fields."""
+    return " or ".join(f'r._field == "{field}"' for field in fields)
+
+def last_query(bucket, org_id, fields, start=QUERY_RANGE_START):
+    """Build the query for the last point of each field since start."""
+    return build_query(f'from(bucket: "{bucket}") |> range(start: {start}) |> filter(fn: (r) => {field_filter(fields)}) |> last() '
+                       f'|> keep(columns: {QUERY_COLUMNS})', org_id)
+
+def flux_duration_seconds(duration):
+    """Length in seconds of a relative Flux duration such as -5m or -1h30m, None for anything else."""
+    parts = re.fullmatch(r"-((?:\d+(?:ms|s|m|h|d|w))+)", duration.strip())
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return sum(int(amount) * units[unit] for amount, unit in re.findall(r"(\d+)(ms|s|m|h|d|w)", parts.group(1)))
+
+class FieldCursors:
+    """Last point seen per field, so a cycle only asks InfluxDB for points since then.
+
+    While every requested field has a cursor inside the QUERY_RANGE_START window,
+    queries use range(start: <oldest cursor>) and the box scans a few seconds of
+    points instead of the whole window. A field without a new point keeps its
+    cursor value ("unchanged"). On startup, after a gap longer than the window or
+    with an absolute QUERY_RANGE_START, the wide window is queried and the cursors
+    are rebuilt from its result.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.points = {}  # field -> (epoch seconds, RFC3339 time, value)
+        self.lock = Lock()
+
+    def start(self, fields):
+        """Return the RFC3339 time of the oldest cursor of the fields, or None if the window has to be queried."""
+        with self.lock:
+            cursors = [self.points.get(field) for field in fields]
+        if self.window is None or not all(cursors):
+            return None
+        oldest = min(cursors)
+        if oldest[0] < time.time() - self.window:
+            return None
+        return oldest[1]
+
+    def reset(self):
+        """Forget all cursors, the next query of every field searches the whole window."""
+        with self.lock:
+            self.points = {}
+
+    def merge(self, parsed, fields, incremental):
+        """Advance the cursors with a parsed response and return the current point of every known field."""
+        with self.lock:
+            if not incremental:
+                for field in fields:
+                    self.points.pop(field, None)
+            for field, (point_time, value) in parsed.items():
+                if not point_time or not re.fullmatch(r"[0-9T:.+\-]+Z?", point_time):
+                    continue
+                point = (parse_influx_time(point_time), point_time, value)
+                if field not in self.points or point[0] >= self.points[field][0]:
+                    self.points[field] = point
+            return {field: (self.points[field][1], self.points[field][2]) for field in fields if field in self.points}
 
 # Log the environment variables for debugging
+logging.info(f"SITES_CONFIG: {SITES_CONFIG}")
 logging.info(f"INFLUX_HOSTS: {INFLUX_HOSTS}")
 logging.info(f"INFLUX_TOKEN: {INFLUX_TOKEN}")
 logging.info(f"INFLUX_BUCKET: {INFLUX_BUCKET}")
@@ -84,6 +835,47 @@ logging.info(f"HTTP_PORT: {HTTP_PORT}")
 logging.info(f"START_TIME: {START_TIME}")
 logging.info(f"END_TIME: {END_TIME}")
 logging.info(f"TIMEZONE: {TIMEZONE}")
+logging.info(f"FETCH_MODE: {FETCH_MODE}")
+logging.info(f"INFLUX_CONNECT_TIMEOUT: {INFLUX_CONNECT_TIMEOUT}")
+logging.info(f"INFLUX_READ_TIMEOUT: {INFLUX_READ_TIMEOUT}")
+logging.info(f"INFLUX_COMPRESSION: {INFLUX_COMPRESSION}")
+logging.info(f"DISCOVERY_MODE: {DISCOVERY_MODE}")
+logging.info(f"BREAKER_FAILURES: {BREAKER_FAILURES}")
+logging.info(f"BREAKER_BACKOFF: {BREAKER_BACKOFF}")
+logging.info(f"BREAKER_MAX_BACKOFF: {BREAKER_MAX_BACKOFF}")
+logging.info(f"FETCH_INTERVAL: {FETCH_INTERVAL}")
+logging.info(f"FETCH_JITTER: {FETCH_JITTER}")
+logging.info(f"FETCH_WORKERS: {FETCH_WORKERS}")
+logging.info(f"POLL_INTERVAL_MIN: {POLL_INTERVAL_MIN}")
+logging.info(f"POLL_INTERVAL_MAX: {POLL_INTERVAL_MAX}")
+logging.info(f"POLL_CHANGE_THRESHOLD: {POLL_CHANGE_THRESHOLD}")
+logging.info(f"LATITUDE: {LATITUDE}")
+logging.info(f"LONGITUDE: {LONGITUDE}")
+logging.info(f"SUN_MARGIN: {SUN_MARGIN}")
+logging.info(f"HISTORY_DEPTH: {HISTORY_DEPTH}")
+logging.info(f"STUCK_WINDOW: {STUCK_WINDOW}")
+logging.info(f"ANOMALY_MAX_POWER: {ANOMALY_MAX_POWER}")
+logging.info(f"ANOMALY_MAX_SOC_RATE: {ANOMALY_MAX_SOC_RATE}")
+logging.info(f"STREAM_PORT: {STREAM_PORT}")
+logging.info(f"STREAM_HEARTBEAT: {STREAM_HEARTBEAT}")
+logging.info(f"STREAM_MAX_CLIENTS: {STREAM_MAX_CLIENTS}")
+logging.info(f"MODBUS_PORT: {MODBUS_PORT}")
+logging.info(f"MODBUS_MAX_CLIENTS: {MODBUS_MAX_CLIENTS}")
+logging.info(f"DERIVED_EMA_SECONDS: {DERIVED_EMA_SECONDS}")
+logging.info(f"DERIVED_SOC_WINDOW: {DERIVED_SOC_WINDOW}")
+logging.info(f"DERIVED_MAX_GAP: {DERIVED_MAX_GAP}")
+logging.info(f"REFRESH_MIN_AGE: {REFRESH_MIN_AGE}")
+logging.info(f"HISTORY_DB: {HISTORY_DB}")
+logging.info(f"HISTORY_RETENTION_DAYS: {HISTORY_RETENTION_DAYS}")
+logging.info(f"HISTORY_FLUSH_INTERVAL: {HISTORY_FLUSH_INTERVAL}")
+logging.info(f"LOG_FORMAT: {LOG_FORMAT}")
+logging.info(f"LOG_LEVEL: {LOG_LEVEL}")
+logging.info(f"LOG_RATE_LIMIT: {LOG_RATE_LIMIT}")
+logging.info(f"SUPERVISOR_INTERVAL: {SUPERVISOR_INTERVAL}")
+logging.info(f"SUPERVISOR_FAILURES: {SUPERVISOR_FAILURES}")
+logging.info(f"SUPERVISOR_STALL: {SUPERVISOR_STALL}")
+logging.info(f"SERVER_MODE: {SERVER_MODE}")
+logging.info(f"WSGI_THREADS: {WSGI_THREADS}")
 
 app = Flask(__name__)
 
@@ -91,552 +883,2122 @@ app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.WARNING)
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+class Scheduler:
+    """Runs periodic jobs at a fixed rate from a single long-lived thread.
 
-def is_within_time_range():
-    """Check if the current time is within the specified start and end time in the given timezone."""
-    tz = pytz.timezone(TIMEZONE)
-    now = datetime.now(tz).time()
-    start_time = datetime.strptime(START_TIME, "%H:%M").time()
-    end_time = datetime.strptime(END_TIME, "%H:%M").time()
-    return start_time <= now <= end_time
-
-def verify_working_ip():
-    """Verify the last known working IP or find a new one."""
-    global last_working_ip, no_working_ip_found
-    no_working_ip_found = False  # Reset the flag at the start of each verification
-
-    # Simple query to test connectivity
-    query = f"""
-    {{
-      "type": "flux",
-      "query": "from(bucket: \\"{INFLUX_BUCKET}\\") |> range(start: -1m) |> limit(n:1)",
-      "orgID": "{INFLUX_ORG_ID}"
-    }}
+    Ticks are planned on the monotonic clock, so a slow run does not shift later
+    ticks. A run that takes longer than its interval is counted as an overrun and
+    the missed ticks are skipped instead of piling up. Jobs run one after another,
+    never concurrently.
     """
 
-    headers = {
-        "Authorization": f"Token {INFLUX_TOKEN}",
-        "Accept": "*/*",  # Accept any content type
-        "Content-type": "application/json"
-    }
-
-    # Try the last known working IP first
-    if last_working_ip:
-        INFLUX_API = f"http://{last_working_ip}:8086/api/v2/query?orgID={INFLUX_ORG_ID}"
-        try:
-            response = requests.post(INFLUX_API, headers=headers, data=query)
-            logging.info(f"Verification response status: {response.status_code}")
-            logging.info(f"Verification response headers: {dict(response.headers)}")
-            logging.info(f"Verification response content: {response.text[:200]}")  # First 200 chars
+    def __init__(self):
+        self.jobs = {}
+        self.condition = Condition()
+        self.thread = None
+        self.running = False
+
+    def add_job(self, name, interval, func, jitter=0.0, delay=0.0):
+        """Run func every interval seconds, first after delay seconds, each tick delayed by up to jitter seconds."""
+        with self.condition:
+            # A job added again keeps its counters, the metrics exported from them must never go backwards
+            previous = self.jobs.get(name, {})
+            self.jobs[name] = {
+                "func": func,
+                "interval": interval,
+                "jitter": jitter,
+                "next_run": time.monotonic() + delay,
+                "due": time.monotonic() + delay,
+                "rescheduled": False,
+                "runs": previous.get("runs", 0),
+                "overruns": previous.get("overruns", 0),
+                "last_duration": previous.get("last_duration")
+            }
+            self.condition.notify()
+
+    def set_interval(self, name, interval):
+        """Change the interval of a job. The tick already planned keeps its time, later ticks use the new interval."""
+        with self.condition:
+            self.jobs[name]["interval"] = interval
+
+    def reschedule(self, name, delay):
+        """Move the next run of a job delay seconds into the future; fixed-rate ticks continue from there."""
+        with self.condition:
+            job = self.jobs[name]
+            job["next_run"] = job["due"] = time.monotonic() + delay
+            job["rescheduled"] = True
+            self.condition.notify()
+
+    def start(self):
+        """Start the scheduler thread, or a new one if it died."""
+        with self.condition:
+            if self.running and self.alive():
+                return
+            self.running = True
+        self.thread = Thread(target=self.run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def alive(self):
+        return bool(self.thread and self.thread.is_alive())
+
+    def stop(self, timeout=None):
+        """Stop after the currently running job has finished."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    name, job = min(self.jobs.items(), key=lambda item: item[1]["due"], default=(None, None))
+                    if job is None:
+                        self.condition.wait()
+                        continue
+                    wait = job["due"] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if not self.running:
+                    return
+                job["rescheduled"] = False
+
+            started = time.monotonic()
+            try:
+                job["func"]()
+            except Exception as e:
+                logging.exception(f"Scheduled job {name} failed: {e}")
+            finished = time.monotonic()
+
+            with self.condition:
+                job["runs"] += 1
+                job["last_duration"] = finished - started
+                if not job["rescheduled"]:
+                    job["next_run"] += job["interval"]
+                    if job["next_run"] <= finished:
+                        missed = int((finished - job["next_run"]) // job["interval"]) + 1
+                        job["overruns"] += 1
+                        job["next_run"] += missed * job["interval"]
+                        logging.warning(f"Job {name} overran its {job['interval']}s interval "
+                                        f"({job['last_duration']:.2f}s), skipping {missed} tick(s).")
+                    # Jitter shifts a single tick only, the fixed-rate grid stays in place
+                    job["due"] = job["next_run"] + (random.uniform(0, job["jitter"]) if job["jitter"] else 0.0)
+
+    def overrun(self, name, running):
+        """Count an overrun of a job whose work runs elsewhere and was still running at the next tick."""
+        with self.condition:
+            job = self.jobs[name]
+            job["overruns"] += 1
+            interval = job["interval"]
+        logging.warning(f"Job {name} overran its {interval}s interval (still running after {running:.2f}s), "
+                        f"the tick joins the run in flight.")
+
+    def stats(self):
+        """Return the run counters of all jobs."""
+        with self.condition:
+            return {name: {"runs": job["runs"], "overruns": job["overruns"], "last_duration": job["last_duration"],
+                           "next_run_in": max(0.0, job["due"] - time.monotonic())}
+                    for name, job in self.jobs.items()}
+
+scheduler = Scheduler()
+
+class SingleFlight:
+    """Collapses concurrent calls of a function into one run.
+
+    The first caller starts the run (in its own thread, or in the background
+    with wait=False); everyone arriving while it is in flight joins it and gets
+    the same completion event instead of starting another run. Background runs
+    go to the given executor, or to a new thread without one.
+    """
 
-            if response.status_code == 200:
-                logging.info(f"Verified working IP: {last_working_ip}")
-                return True
+    def __init__(self, func, name, executor=None):
+        self.func = func
+        self.name = name
+        self.executor = executor
+        self.flight = None
+        self.started = None  # Monotonic start of the run in flight
+        self.lock = Lock()
+
+    def running(self):
+        """Return the seconds the run in flight has been running, or None if there is none."""
+        with self.lock:
+            return time.monotonic() - self.started if self.flight else None
+
+    def do(self, wait=True, timeout=None):
+        """Run func or join the run in flight; returns the Event set when that run completed."""
+        with self.lock:
+            flight = self.flight
+            leader = flight is None
+            if leader:
+                flight = self.flight = Event()
+                self.started = time.monotonic()
+        if leader:
+            if wait:
+                self.execute(flight)
+            elif self.executor:
+                self.executor.submit(self.execute, flight)
             else:
-                logging.error(f"Verification failed with status {response.status_code}.")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Verification request failed: {e}")
-            last_working_ip = None  # Reset last working IP if it fails
+                Thread(target=self.execute, args=(flight,), name=self.name, daemon=True).start()
+        elif wait:
+            flight.wait(timeout)
+        return flight
 
-    # If the last known IP fails, cycle through the list
-    for _ in range(len(INFLUX_HOSTS)):
-        INFLUX_API = get_influx_api()
+    def execute(self, flight):
         try:
-            response = requests.post(INFLUX_API, headers=headers, data=query)
-            logging.info(f"Trying new IP - Response status: {response.status_code}")
-            logging.info(f"Response headers: {dict(response.headers)}")
-            logging.info(f"Response content: {response.text[:200]}")
-
-            if response.status_code == 200:
-                last_working_ip = INFLUX_API.split("//")[1].split(":")[0]
-                logging.info(f"New working IP found: {last_working_ip}")
-                return True
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
+            self.func()
+        except Exception as e:
+            logging.exception(f"{self.name} failed: {e}")
+        finally:
+            with self.lock:
+                self.flight = None
+            flight.set()
+
+def sun_times(day):
+    """Return (sunrise, sunset) of a date at LATITUDE/LONGITUDE as UTC datetimes.
+
+    Uses the NOAA general solar position equations, which are accurate to a
+    minute or two at the latitudes this runs at, so no network lookup is needed.
+    Returns None during polar night and the whole day during polar day.
+    """
+    gamma = 2 * math.pi / 365 * (day.timetuple().tm_yday - 1)
+    eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                       - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma) - 0.006758 * math.cos(2 * gamma)
+            + 0.000907 * math.sin(2 * gamma) - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+    latitude = math.radians(float(LATITUDE))
+    cos_hour_angle = math.cos(math.radians(90.833)) / (math.cos(latitude) * math.cos(decl)) - math.tan(latitude) * math.tan(decl)
+    midnight = datetime(day.year, day.month, day.day, tzinfo=pytz.utc)
+    if cos_hour_angle > 1:
+        return None
+    if cos_hour_angle < -1:
+        return midnight, midnight + timedelta(days=1)
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    sunrise = 720 - 4 * (float(LONGITUDE) + hour_angle) - eqtime
+    sunset = 720 - 4 * (float(LONGITUDE) - hour_angle) - eqtime
+    return midnight + timedelta(minutes=sunrise), midnight + timedelta(minutes=sunset)
+
+def polling_window(day):
+    """Return the (start, end) datetimes of the polling window on a date, or None if there is none."""
+    if LATITUDE and LONGITUDE:
+        sun = sun_times(day)
+        if sun is None:
+            return None
+        margin = timedelta(minutes=SUN_MARGIN)
+        return sun[0] - margin, sun[1] + margin
+    tz = pytz.timezone(TIMEZONE)
+    start_time = datetime.strptime(START_TIME, "%H:%M").time()
+    end_time = datetime.strptime(END_TIME, "%H:%M").time()
+    return tz.localize(datetime.combine(day, start_time)), tz.localize(datetime.combine(day, end_time))
 
-    logging.error("No working IP found.")
-    no_working_ip_found = True
-    return False
+def is_within_time_range():
+    """Check if the current time is within today's polling window (fixed times or sunrise/sunset)."""
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    window = polling_window(now.date())
+    return bool(window) and window[0] <= now <= window[1]
+
+def sun_is_up(timestamp, inset=0):
+    """True between sunrise and sunset (narrowed by inset seconds) at LATITUDE/LONGITUDE, None without coordinates."""
+    if not (LATITUDE and LONGITUDE):
+        return None
+    moment = datetime.fromtimestamp(timestamp, pytz.utc)
+    sun = sun_times(moment.date())
+    return bool(sun) and sun[0] + timedelta(seconds=inset) <= moment <= sun[1] - timedelta(seconds=inset)
+
+def integrate_kwh(timestamps, values, max_gap, clip=None):
+    """Energy in kWh of a power series in W by the trapezoidal rule, skipping gaps longer than max_gap seconds.
+
+    clip="positive" or "negative" integrates only that part of the power (e.g. export or import of the grid power).
+    """
+    def part(value):
+        if clip == "positive":
+            return max(value, 0.0)
+        if clip == "negative":
+            return max(-value, 0.0)
+        return value
+    watt_seconds = 0.0
+    for index in range(1, len(values)):
+        elapsed = timestamps[index] - timestamps[index - 1]
+        if 0 < elapsed <= max_gap:
+            watt_seconds += (part(values[index - 1]) + part(values[index])) / 2 * elapsed
+    return watt_seconds / 3.6e6
+
+class DerivedValues:
+    """Values derived from the meter samples, updated incrementally once per fetch cycle.
+
+    - pv_surplus: grid export plus battery charging power, i.e. the power a
+      wallbox could draw if the battery stopped charging, never below zero
+      (a discharging battery or grid import leave no surplus)
+    - grid_power_ema / solar_power_ema: exponential moving averages whose weight
+      depends on the time since the previous sample (time constant DERIVED_EMA_SECONDS),
+      restarted from the first sample of each day
+    - energy_*_today_kwh: grid import, grid export and production since local
+      midnight, integrated with the trapezoidal rule
+    - battery_soc_rate: change of the battery level in %/h over DERIVED_SOC_WINDOW
+    """
+    ENERGY = {"energy_import_today_kwh": ("grid_power", "negative"),
+              "energy_export_today_kwh": ("grid_power", "positive"),
+              "energy_production_today_kwh": ("solar_power_generation", None)}
+    EMA = {"grid_power_ema": "grid_power", "solar_power_ema": "solar_power_generation"}
+
+    def __init__(self, history):
+        self.history = history
+        self.day = None
+        self.last = {}  # history key -> (timestamp, value) of the previous sample
+        self.ema = {name: None for name in self.EMA}
+        self.energy = {name: 0.0 for name in self.ENERGY}
+        self.current = None
+
+    def local_day(self, timestamp):
+        return datetime.fromtimestamp(timestamp, pytz.timezone(TIMEZONE)).date()
+
+    def update(self, timestamp, values):
+        """Fold the values of one cycle in and return the derived values."""
+        day = self.local_day(timestamp)
+        if day != self.day:
+            # A new day integrates and averages from its own first sample on
+            self.day = day
+            self.last = {}
+            self.ema = {name: None for name in self.EMA}
+            self.energy = {name: 0.0 for name in self.ENERGY}
+
+        for name, (key, clip) in self.ENERGY.items():
+            if key in values and key in self.last:
+                previous_ts, previous = self.last[key]
+                self.energy[name] += integrate_kwh((previous_ts, timestamp), (previous, values[key]), DERIVED_MAX_GAP, clip)
+        for name, key in self.EMA.items():
+            if key in values:
+                average = self.ema[name]
+                if average is None or key not in self.last:
+                    self.ema[name] = values[key]
+                else:
+                    weight = 1 - math.exp(-max(timestamp - self.last[key][0], 0.0) / DERIVED_EMA_SECONDS)
+                    self.ema[name] = average + weight * (values[key] - average)
+        for key, value in values.items():
+            self.last[key] = (timestamp, value)
+
+        self.current = self.render()
+        return self.current
+
+    def render(self):
+        grid = self.last.get("grid_power", (None, 0.0))[1]
+        battery = self.last.get("battery_charge_discharge", (None, 0.0))[1]
+        derived = {"pv_surplus": round(max(grid + battery, 0.0), 1)}
+        derived.update({name: round(value, 1) if value is not None else None for name, value in self.ema.items()})
+        derived.update({name: round(value, 3) for name, value in self.energy.items()})
+        derived["battery_soc_rate"] = self.soc_rate()
+        return derived
+
+    def soc_rate(self):
+        """Battery level change in %/h between the oldest sample in the window and the newest one."""
+        timestamps, values = self.history["battery_charge_level"].since(time.time() - DERIVED_SOC_WINDOW)
+        if len(values) < 2 or timestamps[-1] - timestamps[0] < DERIVED_SOC_WINDOW / 4:
+            return None
+        return round((values[-1] - values[0]) / (timestamps[-1] - timestamps[0]) * 3600, 2)
+
+    def standby(self):
+        """Derived values outside operating hours: no power, the energy totals of the day stay."""
+        derived = {"pv_surplus": 0.0}
+        derived.update({name: 0.0 for name in self.EMA})
+        derived.update({name: round(value, 3) for name, value in self.energy.items()})
+        derived["battery_soc_rate"] = 0.0
+        return derived
+
+    def rebuild(self):
+        """Recompute today's energy totals and the averages from the history buffers, e.g. after a restart."""
+        now = time.time()
+        self.day = self.local_day(now)
+        midnight = pytz.timezone(TIMEZONE).localize(datetime.combine(self.day, datetime.min.time())).timestamp()
+        for name, (key, clip) in self.ENERGY.items():
+            self.energy[name] = integrate_kwh(*self.history[key].since(midnight), DERIVED_MAX_GAP, clip)
+        self.last = {}
+        for key, buffer in self.history.items():
+            if len(buffer) and buffer.last()[0] >= midnight:
+                self.last[key] = buffer.last()
+        for name, key in self.EMA.items():
+            self.ema[name] = self.last[key][1] if key in self.last else None
+        self.current = self.render()
+
+class FieldWindow:
+    """Running statistics over the latest samples of one value.
+
+    The minimum and maximum come from monotonic deques, mean and variance from
+    running sums, so push() is O(1) amortized whatever the window size. The
+    sums are recomputed once per window length to keep rounding from drifting.
+    """
 
-def update_history(history_list, new_value):
-    """Update the history list with the new value and current timestamp."""
-    current_time = datetime.now()
-    if len(history_list) >= 60:  # Increased from 10 to 60
-        history_list.pop(0)
-    history_list.append((current_time, new_value))
+    def __init__(self, size):
+        self.size = size
+        self.samples = deque()  # (timestamp, value), oldest first
+        self.lows = deque()  # (sequence, value) with increasing values
+        self.highs = deque()  # (sequence, value) with decreasing values
+        self.sequence = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.last_change = None  # Timestamp of the first sample holding the current value
+
+    def __len__(self):
+        return len(self.samples)
+
+    def push(self, timestamp, value):
+        if not self.samples or value != self.samples[-1][1]:
+            self.last_change = timestamp
+        sequence = self.sequence
+        self.sequence += 1
+        self.samples.append((timestamp, value))
+        self.total += value
+        self.squares += value * value
+        while self.lows and self.lows[-1][1] >= value:
+            self.lows.pop()
+        self.lows.append((sequence, value))
+        while self.highs and self.highs[-1][1] <= value:
+            self.highs.pop()
+        self.highs.append((sequence, value))
+
+        if len(self.samples) > self.size:
+            _, dropped = self.samples.popleft()
+            self.total -= dropped
+            self.squares -= dropped * dropped
+            oldest = sequence - self.size + 1
+            if self.lows[0][0] < oldest:
+                self.lows.popleft()
+            if self.highs[0][0] < oldest:
+                self.highs.popleft()
+        if self.sequence % self.size == 0:
+            self.total = sum(value for _, value in self.samples)
+            self.squares = sum(value * value for _, value in self.samples)
+
+    def last(self):
+        """Return the latest (timestamp, value) sample, or None if there is none."""
+        return self.samples[-1] if self.samples else None
+
+    def minimum(self):
+        return self.lows[0][1]
+
+    def maximum(self):
+        return self.highs[0][1]
+
+    def mean(self):
+        return self.total / len(self.samples)
+
+    def variance(self):
+        return max(self.squares / len(self.samples) - self.mean() ** 2, 0.0)
+
+    def frozen(self):
+        """True once the window is full and holds a single repeated value."""
+        return len(self.samples) == self.size and self.minimum() == self.maximum()
+
+class AnomalyDetector:
+    """Frozen and implausible meter values, evaluated once per fetch cycle.
+
+    Every history value has a FieldWindow over its latest STUCK_WINDOW samples.
+    A value is frozen when the full window holds one repeated value, unless that
+    is normal: no solar power while the sun is down (always accepted without
+    coordinates), flat solar power while grid or battery power still move
+    (snow on the panels, curtailment), an idle battery, no grid power while the battery covers the
+    difference, or a constant battery level while the battery power averages
+    below BATTERY_IDLE_WATTS. A jump is a value the system cannot
+    physically produce: power beyond ANOMALY_MAX_POWER, a battery level outside
+    0-100 % or changing faster than ANOMALY_MAX_SOC_RATE. It stays flagged while
+    its sample is in the window. The verdict is kept ready for /health.
+    """
+    BATTERY_IDLE_WATTS = 1000
+    DAYLIGHT_INSET = 1800  # Seconds after sunrise and before sunset in which no solar power is still normal
+
+    def __init__(self, history, size):
+        self.history = history
+        self.size = size
+        self.windows = {key: FieldWindow(size) for key in history}
+        self.frozen = {}  # key -> reason the frozen value is normal, None if it is not
+        self.jumps = {}  # key -> (timestamp, previous value, value)
+        self.verdict = None
+
+    def update(self, timestamp, values):
+        """Fold the values of one cycle in and return the verdict, None while nothing is wrong."""
+        for key, value in values.items():
+            window = self.windows[key]
+            if self.implausible(key, timestamp, value, window.last()):
+                previous = window.last()
+                self.jumps[key] = (timestamp, previous[1] if previous else None, value)
+            window.push(timestamp, value)
+        return self.evaluate(timestamp)
+
+    def implausible(self, key, timestamp, value, previous):
+        if key == "battery_charge_level":
+            if not 0 <= value <= 100:
+                return True
+            if previous is None:
+                return False
+            # One percent of slack for the rounding of the level
+            return abs(value - previous[1]) > 1 + ANOMALY_MAX_SOC_RATE * max(timestamp - previous[0], 0.0) / 3600
+        return abs(value) > ANOMALY_MAX_POWER
+
+    def expected_freeze(self, key, timestamp, value):
+        """Why a frozen value is normal, or None."""
+        if key == "solar_power_generation":
+            if value == 0 and not sun_is_up(timestamp, self.DAYLIGHT_INSET):
+                return "no sun"
+            if not (self.windows["grid_power"].frozen() and self.windows["battery_charge_discharge"].frozen()):
+                return "grid or battery still change"
+        if key == "battery_charge_discharge" and value == 0:
+            return "battery idle"
+        battery = self.windows["battery_charge_discharge"]
+        if key == "grid_power" and value == 0 and len(battery) and battery.maximum() != battery.minimum():
+            return "battery balancing the grid"
+        if key == "battery_charge_level" and len(battery) and abs(battery.mean()) < self.BATTERY_IDLE_WATTS:
+            return "battery power too low to move the level"
+        return None
+
+    def evaluate(self, timestamp):
+        self.frozen = {key: self.expected_freeze(key, timestamp, window.last()[1])
+                       for key, window in self.windows.items() if window.frozen()}
+        for key, (jumped_at, _, _) in list(self.jumps.items()):
+            if not len(self.windows[key]) or jumped_at < self.windows[key].samples[0][0]:
+                del self.jumps[key]
+
+        problems = []
+        frozen = self.stuck()
+        if frozen:
+            problems.append(f"Stuck values detected in {', '.join(frozen)}")
+        for key, (_, previous, value) in self.jumps.items():
+            problems.append(f"Implausible value of {key}: {previous} -> {value}")
+        self.verdict = "; ".join(problems) or None
+        return self.verdict
+
+    def stuck(self):
+        """Return the values that are frozen without a normal reason."""
+        return [key for key, normal in self.frozen.items() if normal is None]
+
+    def rebuild(self):
+        """Refill the windows from the history buffers, e.g. after a restart."""
+        self.windows = {key: FieldWindow(self.size) for key in self.history}
+        self.jumps = {}
+        newest = None
+        for key, buffer in self.history.items():
+            for timestamp, value in zip(*buffer.window(self.size)):
+                self.windows[key].push(timestamp, value)
+                newest = timestamp if newest is None else max(newest, timestamp)
+        if newest is not None:
+            self.evaluate(newest)
+
+    def state(self):
+        """Return the detector state of every value for /debug/anomalies."""
+        fields = {}
+        for key, window in self.windows.items():
+            if not len(window):
+                fields[key] = {"samples": 0}
+                continue
+            jump = self.jumps.get(key)
+            fields[key] = {
+                "samples": len(window),
+                "min": window.minimum(),
+                "max": window.maximum(),
+                "mean": round(window.mean(), 3),
+                "stddev": round(math.sqrt(window.variance()), 3),
+                "last_change": datetime.fromtimestamp(window.last_change).isoformat(),
+                "unchanged_seconds": round(window.last()[0] - window.last_change, 1),
+                "frozen": key in self.frozen,
+                "frozen_normal": self.frozen.get(key),
+                "jump": {"at": datetime.fromtimestamp(jump[0]).isoformat(), "from": jump[1], "to": jump[2]} if jump else None,
+            }
+        return {"verdict": self.verdict, "window": self.size, "fields": fields}
+
+def downsample_minmax(timestamps, values, max_points):
+    """Reduce a series to at most max_points samples keeping the extremes.
+
+    The samples are split into max_points // 2 buckets of equal count and each
+    bucket contributes its minimum and maximum in time order, so spikes survive
+    the reduction. Each bucket is one list slice scanned by the C builtins
+    min(), max() and index() instead of a Python loop over its samples.
+    """
+    n = len(values)
+    buckets = max(max_points // 2, 1)
+    if n <= max_points:
+        return list(timestamps), list(values)
+    size = -(-n // buckets)
+    values = values.tolist() if isinstance(values, memoryview) else values
+    out_ts, out_values = [], []
+    for first in range(0, n, size):
+        bucket = values[first:first + size]
+        low, high = min(bucket), max(bucket)
+        low_index, high_index = first + bucket.index(low), first + bucket.index(high)
+        for index in sorted({low_index, high_index}):
+            out_ts.append(timestamps[index])
+            out_values.append(values[index])
+    return out_ts, out_values
+
+def render_history(site, field, start, end, max_points):
+    """Render the /history body of a field of a site between start and end."""
+    timestamps, values = site.history_range(field, start, end)
+    samples = len(values)
+    timestamps, values = downsample_minmax(timestamps, values, max_points)
+    return render_json({
+        "field": field,
+        "start": start,
+        "end": end,
+        "samples": samples,
+        "timestamps": [round(ts, 3) for ts in timestamps],
+        "values": values
+    })
+
+# Bodies of closed ranges (ending before the newest sample) no longer change
+render_closed_history = lru_cache(maxsize=128)(render_history)
+
+def parse_history_time(value, default):
+    """Parse a /history time parameter given as epoch seconds or ISO 8601 (local TIMEZONE if naive)."""
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(TIMEZONE).localize(parsed)
+    return parsed.timestamp()
 
 def get_delay_until_start():
     """Calculate the delay in seconds until the next start time."""
-    tz = pytz.timezone(TIMEZONE)
-    now = datetime.now(tz)
-    start_time = datetime.strptime(START_TIME, "%H:%M").replace(
-        year=now.year, month=now.month, day=now.day, tzinfo=tz
-    )
-    
-    # If start time is earlier than current time, add one day
-    if start_time <= now:
-        start_time = start_time + timedelta(days=1)
-    
-    delay = (start_time - now).total_seconds()
+    now = datetime.now(pytz.timezone(TIMEZONE))
+
+    # The next window that has not started yet, skipping days without one (polar night)
+    delay = 86400
+    for days in range(367):
+        window = polling_window(now.date() + timedelta(days=days))
+        if window and window[0] > now:
+            delay = (window[0] - now).total_seconds()
+            break
+
     logging.info(f"Calculated delay until next start: {delay} seconds")
     return delay
 
-def fetch_data():
-    global cached_solar_generation, cached_grid_power, cached_battery_data, data_fetch_successful, fetch_count, initialization_phase
-    
-    if not is_within_time_range():
-        # Set all values to 0 during off-hours
-        cached_solar_generation = {"solar_power_generation": 0.0}
-        cached_grid_power = {"grid_power": 0.0}
-        cached_battery_data = {
-            "battery_charge_discharge": 0.0,
-            "battery_charge_level": 0.0
-        }
-        data_fetch_successful = True  # Set to true so health check returns 200
-        
-        # Schedule next fetch at start time
-        logging.warning("Outside specified time range. Scheduling next fetch at start time.")
-        delay = get_delay_until_start()
-        Timer(delay, fetch_data).start()
-        return
-
-    if initialization_phase:
-        logging.info("Application is in the initialization phase.")
-
-    if not verify_working_ip():
-        logging.error("Data fetch aborted due to no working IP.")
-        Timer(10, fetch_data).start()  
-        return
-
-    data_fetch_successful = False 
-    
-    logging.info("Within time range, fetching data...")
-    # Fetch solar generation data
-    cached_solar_generation = fetch_solar_generation()
-    update_history(solar_generation_history, cached_solar_generation)
-    logging.debug(f"Cached Solar Generation Data: {cached_solar_generation}")
-
-    # Fetch grid power data
-    cached_grid_power = fetch_grid_power()
-    update_history(grid_power_history, cached_grid_power)
-    logging.debug(f"Cached Grid Power Data: {cached_grid_power}")
-
-    # Fetch battery data
-    cached_battery_data = fetch_battery_data()
-    if cached_battery_data:
-        # Create a combined battery data dictionary with both power and level
-        battery_history_data = {
-            'battery_charge_level': cached_battery_data['battery_charge_level'],
-            'battery_power': cached_battery_data['battery_charge_discharge']
-        }
-        update_history(battery_data_history, battery_history_data)
-    logging.debug(f"Cached Battery Data: {cached_battery_data}")
+class SiteLogger(logging.LoggerAdapter):
+    """Prefixes the messages of a site with its name while more than one site is polled."""
 
-    # Record the timestamp of this fetch
-    fetch_timestamps.append(datetime.now())
-    if len(fetch_timestamps) > 10:
-        fetch_timestamps.pop(0)
+    def process(self, msg, kwargs):
+        return (f"[{self.extra['site']}] {msg}" if len(sites) > 1 else msg), kwargs
 
-    # Increment the fetch count
-    fetch_count += 1
+class Site:
+    """One Enpal installation: its hosts with their breakers, query cursors, history and latest snapshot.
 
-    # Check if we need to exit the initialization phase
-    if fetch_count >= 10 and initialization_phase:
-        logging.info("Exiting initialization phase.")
-        initialization_phase = False
-        # Only change to WARNING if not in DEBUG mode
-        if logging.getLogger().getEffectiveLevel() != logging.DEBUG:
-            logging.getLogger().setLevel(logging.WARNING)
-
-    # Check if all data fetches were successful
-    if cached_solar_generation and cached_grid_power and cached_battery_data:
-        data_fetch_successful = True
-        logging.info("Data fetch successful.")
-    else:
-        logging.error("Data fetch failed for one or more components.")
-
-    # Schedule the next fetch in 10 seconds
-    logging.info("Scheduling the next data fetch in 10 seconds.")
-    Timer(10, fetch_data).start()
-
-def fetch_solar_generation():
-    logging.debug("Fetching solar generation data...")
-    query = f"""
-    {{
-      "type": "flux",
-      "query": "from(bucket: \\"{INFLUX_BUCKET}\\") |> range(start: {QUERY_RANGE_START}) |> filter(fn: (r) => r._field == \\"Power.Production.Total\\") |> last()",
-      "orgID": "{INFLUX_ORG_ID}"
-    }}
+    Every site is fetched by its own scheduler job. The cycles run on the shared
+    fetch executor, so a slow or unreachable box does not hold up the other
+    sites, and the scheduler, HTTP server, executors and logging exist once per
+    process however many sites there are.
     """
 
-    headers = {
-        "Authorization": f"Token {INFLUX_TOKEN}",
-        "Accept": "application/csv",  # Changed to CSV since that's what InfluxDB typically returns
-        "Content-type": "application/json"
-    }
+    def __init__(self, name, hosts, token, org_id, bucket, history_db=None):
+        self.name = name
+        self.hosts = hosts
+        self.bucket = bucket
+        self.log = SiteLogger(logging.getLogger(), {"site": name})
+        self.job = f"fetch_{name}"
+        self.history = {key: RingBuffer(HISTORY_DEPTH) for key in HISTORY_KEYS}
+        self.fetch_timestamps = deque(maxlen=10)  # Timestamps of the last 10 fetches
+        self.history_db = history_db
+        self.history_store = None  # Opened by restore_history(), so importing enpal creates no file
+        self.host_pool = HostPool(hosts, BREAKER_FAILURES, BREAKER_BACKOFF, BREAKER_MAX_BACKOFF)
+        self.influx_client = InfluxClient(hosts, token, org_id, INFLUX_CONNECT_TIMEOUT, INFLUX_READ_TIMEOUT, self.host_pool)
+        self.field_cursors = FieldCursors(flux_duration_seconds(QUERY_RANGE_START))
+        self.derived_values = DerivedValues(self.history)
+        self.anomalies = AnomalyDetector(self.history, STUCK_WINDOW)
+
+        # Query bodies are built once at startup
+        self.org_id = org_id
+        self.probe_query = build_query(f'from(bucket: "{bucket}") |> range(start: -1m) |> limit(n:1) |> keep(columns: ["_time"])', org_id)
+        self.combined_query = last_query(bucket, org_id, ALL_FIELDS)
+        self.solar_query = last_query(bucket, org_id, [SOLAR_FIELD])
+        self.grid_query = last_query(bucket, org_id, [GRID_EXPORT_FIELD, GRID_IMPORT_FIELD])
+        self.battery_query = last_query(bucket, org_id, [BATTERY_POWER_FIELD, BATTERY_LEVEL_FIELD])
+
+        # The snapshot of the latest fetch cycle, replaced as a whole by every cycle
+        self.current_snapshot = None
+        # Numbers the snapshots of this site without gaps, the id of its stream events
+        self.cycle_ids = count(1)
+        self.initialization_phase = True
+        self.fetch_count = 0
+        # Current interval of the fetch job, adapted to how fast the values change
+        self.poll_interval = FETCH_INTERVAL
+        # Scheduled ticks and on-demand refreshes share one in-flight fetch
+        self.fetch_flight = SingleFlight(self.run_cycle, f"refresh {name}", executor=fetch_executor)
+        # Watched by the supervisor
+        self.cycle_finished = time.monotonic()
+        self.failed_cycles = 0
+
+    def cursor_query(self, fields, window_query):
+        """Return (body, incremental) for the fields, falling back to the prebuilt window query."""
+        start = self.field_cursors.start(fields)
+        if start is None:
+            INFLUX_QUERIES.inc(site=self.name, range="window")
+            return window_query, False
+        INFLUX_QUERIES.inc(site=self.name, range="cursor")
+        return last_query(self.bucket, self.org_id, fields, start=start), True
+
+    def get_influx_host(self, exclude=()):
+        """Get the working host, otherwise the best usable one, skipping hosts in exclude. None while all circuits are open."""
+        host = self.host_pool.working()
+        if host and host not in exclude:
+            return host
+        candidates = [host for host in self.host_pool.candidates() if host not in exclude]
+        return candidates[0] if candidates else None
+
+    def verify_working_ip(self):
+        """Probe the working host, otherwise find one (all hosts at once or one after another)."""
+        host = self.host_pool.working()
+        if host and self.probe_host(host)[1]:
+            return True
+
+        if DISCOVERY_MODE == "concurrent":
+            return self.discover_working_host() is not None
+
+        for host in self.host_pool.candidates():
+            if self.probe_host(host)[1]:
+                self.log.info(f"New working IP found: {host}")
+                return True
+        return False
 
-    for _ in range(len(INFLUX_HOSTS)):
-        INFLUX_API = get_influx_api()
+    def probe_host(self, host):
+        """Send the connectivity probe to a single host and return (host, ok, latency in seconds)."""
+        started = time.monotonic()
         try:
-            response = requests.post(INFLUX_API, headers=headers, data=query)
-            logging.debug(f"Response status: {response.status_code} from {INFLUX_API}")
-            logging.debug(f"Raw response content: {response.text[:200]}")  # Log first 200 chars of response
-
-            if response.status_code == 200:
-                if not response.text.strip():
-                    logging.error("Received empty response")
-                    continue
-
-                try:
-                    data = StringIO(response.text)
-                    df = pd.read_csv(data)
-                    if not df.empty:
-                        solar_generation = df[df['_field'] == 'Power.Production.Total']['_value'].iloc[-1]
-                        last_working_ip = INFLUX_API.split("//")[1].split(":")[0]
-                        return {"solar_power_generation": float(solar_generation)}
-                    else:
-                        logging.error("DataFrame is empty after parsing CSV")
-                except pd.errors.EmptyDataError:
-                    logging.error("Empty data received from API")
-                except Exception as e:
-                    logging.error(f"Error parsing CSV response: {str(e)}")
-                    logging.debug(f"Full response content: {response.text}")
-            else:
-                logging.error(f"Data query failed with status {response.status_code}.")
-                logging.error(f"Error response: {response.text}")
+            response = self.influx_client.query(host, self.probe_query, accept="*/*")
+            return host, response.status_code == 200, time.monotonic() - started
         except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
-            last_working_ip = None
-        except Exception as e:
-            logging.error(f"Unexpected error while fetching solar data: {str(e)}")
-            continue
-
-    return None
-
-def fetch_grid_power():
-    logging.debug("Fetching grid import/export data...")
-    query = f"""
-    {{
-      "type": "flux",
-      "query": "from(bucket: \\"{INFLUX_BUCKET}\\") |> range(start: {QUERY_RANGE_START}) |> filter(fn: (r) => r._field == \\"Power.Grid.Export\\" or r._field == \\"Power.Grid.Import\\") |> last()",
-      "orgID": "{INFLUX_ORG_ID}"
-    }}
-    """
-
-    headers = {
-        "Authorization": f"Token {INFLUX_TOKEN}",
-        "Accept": "application/csv",  # Changed to CSV
-        "Content-type": "application/json"
-    }
-
-    for _ in range(len(INFLUX_HOSTS)):
-        INFLUX_API = get_influx_api()
+            self.log.debug(f"Probe of {host} failed: {e}")
+            return host, False, time.monotonic() - started
+
+    def discover_working_host(self, hosts=None):
+        """Probe all usable hosts in parallel and return the first one answering with 200, or None.
+
+        Recovery is bounded by a single request timeout regardless of how many hosts
+        are configured. Hosts whose circuit is open are left alone unless they are
+        passed in hosts. Probes still running when a winner is found are abandoned;
+        their results only feed the host breakers.
+        """
+        candidates = hosts or self.host_pool.candidates()
+        if not candidates:
+            self.log.debug("All host circuits are open, skipping discovery.")
+            return None
+
+        futures = [discovery_executor.submit(self.probe_host, host) for host in candidates]
         try:
-            response = requests.post(INFLUX_API, headers=headers, data=query)
-            logging.debug(f"Response status: {response.status_code} from {INFLUX_API}")
-            logging.debug(f"Raw response content: {response.text[:200]}")
+            for future in as_completed(futures, timeout=INFLUX_CONNECT_TIMEOUT + INFLUX_READ_TIMEOUT):
+                host, ok, latency = future.result()
+                if ok:
+                    self.log.info(f"New working IP found: {host} ({latency * 1000:.0f} ms)")
+                    return host
+        except FuturesTimeoutError:
+            self.log.error("Host discovery timed out.")
+        finally:
+            for future in futures:
+                future.cancel()
+        return None
+
+    def update_history(self, *meters):
+        """Append the values of the given meter dicts to their ring buffers with the current timestamp."""
+        current_time = time.time()
+        values = {}
+        for meter in meters:
+            if not meter:
+                continue
+            for key, value in meter.items():
+                if key in self.history:
+                    self.history[key].append(current_time, value)
+                    values[key] = value
+        if self.history_store and values:
+            self.history_store.record(current_time, values)
+        return current_time, values
+
+    def restore_history(self):
+        """Open the history store and rehydrate the history buffers and fetch counter from it after a restart."""
+        if not self.history_db or self.history_store:
+            return
+        started = time.monotonic()
+        self.history_store = HistoryStore(self.history_db, HISTORY_RETENTION_DAYS)
+        restored = 0
+        for key, buffer in self.history.items():
+            for timestamp, value in self.history_store.load(key, buffer.capacity):
+                buffer.append(timestamp, value)
+                restored += 1
+
+        # The newest timestamps stand in for the fetches before the restart
+        newest = self.history["grid_power"].window(self.fetch_timestamps.maxlen)[0]
+        self.fetch_timestamps.extend(datetime.fromtimestamp(ts) for ts in newest)
+
+        self.fetch_count = self.history_store.load_state().get("fetch_count", 0)
+        recent = len(newest) and time.time() - newest[-1] < timedelta(hours=2).total_seconds()
+        if self.fetch_count >= 10 and recent and self.initialization_phase:
+            self.log.info("Restored history is recent, skipping the initialization phase.")
+            self.end_initialization_phase()
+        self.derived_values.rebuild()
+        self.anomalies.rebuild()
+        self.log.warning(f"Restored {restored} samples from {self.history_store.path} in {time.monotonic() - started:.3f}s.")
+
+    def end_initialization_phase(self):
+        """Leave the initialization phase; the log level is shared and drops once no site is initializing."""
+        self.initialization_phase = False
+        if any(site.initialization_phase for site in sites.values()):
+            return
+        # Only change to WARNING if not in DEBUG mode
+        if logging.getLogger().getEffectiveLevel() != logging.DEBUG:
+            logging.getLogger().setLevel(logging.WARNING)
 
-            if response.status_code == 200:
-                if not response.text.strip():
-                    logging.error("Received empty response")
+    def history_range(self, field, start, end):
+        """Return (timestamps, values) of a field between start and end.
+
+        Served from the ring buffer as memoryviews, samples that already fell out of
+        the full buffer are read from the history store.
+        """
+        buffer = self.history[field]
+        timestamps, values = buffer.since(start)
+        stop = bisect_left(timestamps, end + 1e-6)
+        timestamps, values = timestamps[:stop], values[:stop]
+        oldest = buffer.window()[0][:1]
+        if self.history_store and len(buffer) == buffer.capacity and start < oldest[0]:
+            older_ts, older_values = self.history_store.range(field, start, min(end, oldest[0] - 1e-6))
+            if older_ts:
+                return older_ts + timestamps.tolist(), older_values + values.tolist()
+        return timestamps, values
+
+    def publish(self, snapshot):
+        """Make a snapshot the current one. The default site also pushes it to stream subscribers and the Modbus register image."""
+        self.current_snapshot = snapshot
+        if self is not default_site:
+            return
+        if modbus_server:
+            modbus_server.publish(snapshot)
+        if stream_server:
+            stream_server.publish(snapshot)
+
+    def run_cycle(self):
+        """Run one fetch cycle and note when it finished, the supervisor's sign of life of the fetch loop."""
+        try:
+            self.fetch_data()
+        finally:
+            self.cycle_finished = time.monotonic()
+
+    def tick(self):
+        """Scheduled fetch: hand a cycle to the fetch executor, counting an overrun if the previous one still runs."""
+        running = self.fetch_flight.running()
+        if running is not None:
+            scheduler.overrun(self.job, running)
+        self.fetch_flight.do(wait=False)
+
+    def restart_fetch_worker(self):
+        """Abandon a hanging fetch cycle: new single flight and scheduler job, then start a cycle right away.
+
+        The hanging run keeps its executor thread until its request times out.
+        """
+        self.fetch_flight = SingleFlight(self.run_cycle, f"refresh {self.name}", executor=fetch_executor)
+        scheduler.add_job(self.job, self.poll_interval, self.tick, jitter=FETCH_JITTER)
+        scheduler.start()  # Only does something if the scheduler thread died
+        self.fetch_flight.do(wait=False)
+
+    def fetch_data(self):
+        if not is_within_time_range():
+            # Set all values to 0 during off-hours
+            self.publish(Snapshot(
+                solar_generation={"solar_power_generation": 0.0},
+                grid_power={"grid_power": 0.0},
+                battery_data={
+                    "battery_charge_discharge": 0.0,
+                    "battery_charge_level": 0.0
+                },
+                successful=True,  # Set to true so health check returns 200
+                initialization_phase=self.initialization_phase,
+                standby=True,
+                derived=self.derived_values.standby(),
+                cycle_id=next(self.cycle_ids)
+            ))
+
+            # Schedule next fetch at start time
+            self.log.warning("Outside specified time range. Scheduling next fetch at start time.")
+            scheduler.reschedule(self.job, get_delay_until_start())
+            return
+
+        if self.initialization_phase:
+            self.log.debug("Application is in the initialization phase.")
+
+        cycle_started = time.monotonic()
+        if FETCH_MODE == "combined":
+            # A successful data query doubles as the connectivity check
+            solar_generation, grid_power, battery_data, source_time = self.fetch_all_data()
+            if not (solar_generation or grid_power or battery_data):
+                # Stay quiet while every circuit is open, the breakers log their transitions
+                self.log.log(logging.DEBUG if self.host_pool.down() else logging.ERROR, "Data fetch aborted, no host delivered data.")
+                FETCH_PHASE_SECONDS.observe(time.monotonic() - cycle_started, site=self.name, phase="total")
+                FETCH_CYCLES.inc(site=self.name, result="no_host")
+                self.failed_cycles += 1
+                return
+
+            self.log.debug("Within time range, fetched all data in one query.")
+        else:
+            with FETCH_PHASE_SECONDS.time(site=self.name, phase="probe"):
+                verified = self.verify_working_ip()
+            if not verified:
+                self.log.log(logging.DEBUG if self.host_pool.down() else logging.ERROR, "Data fetch aborted due to no working IP.")
+                FETCH_PHASE_SECONDS.observe(time.monotonic() - cycle_started, site=self.name, phase="total")
+                FETCH_CYCLES.inc(site=self.name, result="no_host")
+                self.failed_cycles += 1
+                return
+
+            self.log.debug("Within time range, fetching data...")
+            solar_generation = self.fetch_solar_generation()
+            grid_power = self.fetch_grid_power()
+            battery_data = self.fetch_battery_data()
+            source_time = None
+
+        sampled_at, values = self.update_history(solar_generation, grid_power, battery_data)
+        derived = self.derived_values.update(sampled_at, values) if values else self.derived_values.current
+        if values:
+            verdict = self.anomalies.verdict
+            if self.anomalies.update(sampled_at, values) and self.anomalies.verdict != verdict:
+                log_warning_condition(self, self.anomalies.verdict, "/debug/anomalies")
+        self.log.debug(f"Solar Generation Data: {solar_generation}")
+        self.log.debug(f"Grid Power Data: {grid_power}")
+        self.log.debug(f"Battery Data: {battery_data}")
+
+        # Record the timestamp of this fetch
+        self.fetch_timestamps.append(datetime.now())
+
+        # Increment the fetch count
+        self.fetch_count += 1
+
+        # Check if we need to exit the initialization phase
+        if self.fetch_count >= 10 and self.initialization_phase:
+            self.log.info("Exiting initialization phase.")
+            self.end_initialization_phase()
+
+        # Check if all data fetches were successful
+        successful = bool(solar_generation and grid_power and battery_data)
+        if successful:
+            self.log.debug("Data fetch successful.")
+            FETCH_CYCLES.inc(site=self.name, result="ok")
+            self.failed_cycles = 0
+        else:
+            self.log.error("Data fetch failed for one or more components.")
+            FETCH_CYCLES.inc(site=self.name, result="failed")
+            self.failed_cycles += 1
+
+        # Publish all values of this cycle at once
+        self.publish(Snapshot(solar_generation, grid_power, battery_data, successful=successful,
+                              initialization_phase=self.initialization_phase, source_time=source_time, derived=derived,
+                              cycle_id=next(self.cycle_ids)))
+        FETCH_PHASE_SECONDS.observe(time.monotonic() - cycle_started, site=self.name, phase="total")
+        self.adapt_poll_interval()
+
+    def adapt_poll_interval(self):
+        """Poll at POLL_INTERVAL_MIN while grid or battery power moves, back off towards POLL_INTERVAL_MAX while flat.
+
+        A change of at least POLL_CHANGE_THRESHOLD watts between the last two samples
+        drops straight to the minimum, every flat cycle stretches the interval by half.
+        """
+        changing = False
+        for key in ("grid_power", "battery_charge_discharge"):
+            values = self.history[key].window(2)[1]
+            if len(values) == 2 and abs(values[1] - values[0]) >= POLL_CHANGE_THRESHOLD:
+                changing = True
+        interval = POLL_INTERVAL_MIN if changing else min(self.poll_interval * 1.5, POLL_INTERVAL_MAX)
+        if interval != self.poll_interval:
+            self.log.debug(f"Poll interval {self.poll_interval:g}s -> {interval:g}s")
+            self.poll_interval = interval
+            scheduler.set_interval(self.job, interval)
+
+    def fetch_all_data(self):
+        """Fetch all meters with a single Flux query.
+
+        Returns a (solar_generation, grid_power, battery_data, source_time) tuple, all None if
+        no host delivered data. source_time is the newest _time of the returned points. A 200 response also serves as the connectivity check, so the
+        separate verification probe is skipped in this mode.
+        """
+        self.log.debug("Fetching all meter data...")
+        # Prefer the working host, then fail over in the order of the host breakers, each host once
+        tried = set()
+        for _ in range(len(self.hosts)):
+            if not self.host_pool.working() and DISCOVERY_MODE == "concurrent":
+                with FETCH_PHASE_SECONDS.time(site=self.name, phase="probe"):
+                    discovered = self.discover_working_host()
+                if not discovered:
+                    break
+            host = self.get_influx_host(exclude=tried)
+            if host is None:
+                break
+            tried.add(host)
+            query, incremental = self.cursor_query(ALL_FIELDS, self.combined_query)
+            response = None
+            try:
+                with FETCH_PHASE_SECONDS.time(site=self.name, phase="http"):
+                    response = self.influx_client.query(host, query, stream=True)
+                self.log.debug(f"Response status: {response.status_code} from {host}")
+
+                if response.status_code != 200:
+                    self.log.error(f"Data query failed with status {response.status_code}.")
+                    self.log.error(f"Error response: {response.text}")
                     continue
 
+                sizes = {"wire": 0, "decoded": 0}
                 try:
-                    data = StringIO(response.text)
-                    df = pd.read_csv(data)
-                    if not df.empty:
-                        grid_export = df[df['_field'] == 'Power.Grid.Export']['_value'].iloc[-1] if 'Power.Grid.Export' in df['_field'].values else 0
-                        grid_import = df[df['_field'] == 'Power.Grid.Import']['_value'].iloc[-1] if 'Power.Grid.Import' in df['_field'].values else 0
-                        grid_power = float(grid_export) - float(grid_import)
-                        last_working_ip = INFLUX_API.split("//")[1].split(":")[0]
-                        return {"grid_power": grid_power}
-                    else:
-                        logging.error("DataFrame is empty after parsing CSV")
-                except pd.errors.EmptyDataError:
-                    logging.error("Empty data received from API")
-                except Exception as e:
-                    logging.error(f"Error parsing CSV response: {str(e)}")
-                    logging.debug(f"Full response content: {response.text}")
-            else:
-                logging.error(f"Data query failed with status {response.status_code}.")
-                logging.error(f"Error response: {response.text}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
-            last_working_ip = None
-        except Exception as e:
-            logging.error(f"Unexpected error while fetching grid data: {str(e)}")
-            continue
-
-    return None
-
-def fetch_battery_data():
-    logging.debug("Fetching battery data...")
-    # Updated field names based on the actual JSON data structure
-    query = f"""
-    {{
-      "type": "flux",
-      "query": "from(bucket: \\"{INFLUX_BUCKET}\\") |> range(start: {QUERY_RANGE_START}) |> filter(fn: (r) => r._field == \\"Power.Battery.Charge.Discharge\\" or r._field == \\"Percent.Storage.Level\\") |> last()",
-      "orgID": "{INFLUX_ORG_ID}"
-    }}
-    """
-
-    headers = {
-        "Authorization": f"Token {INFLUX_TOKEN}",
-        "Accept": "*/*",
-        "Content-type": "application/json"
-    }
-
-    for _ in range(len(INFLUX_HOSTS)):
-        INFLUX_API = get_influx_api()
-        logging.debug(f"Trying INFLUX_API: {INFLUX_API}")
-        try:
-            response = requests.post(INFLUX_API, headers=headers, data=query)
-            logging.info(f"Battery data response status: {response.status_code}")
-            logging.info(f"Battery data response content: {response.text[:200]}")
-
-            if response.status_code == 200:
-                if not response.text.strip():
-                    logging.error("Received empty response")
+                    # The body is streamed, so this phase also covers its transfer. The CPU time leaves it out.
+                    with FETCH_PHASE_SECONDS.time(site=self.name, phase="parse"), \
+                            INFLUX_PARSE_SECONDS.time(clock=time.thread_time, query="combined"):
+                        parsed = parse_influx_csv(iter_response_lines(response, sizes))
+                    INFLUX_RESPONSE_BYTES.observe(sizes["wire"], query="combined")
+                    INFLUX_DECODED_BYTES.observe(sizes["decoded"], query="combined")
+                finally:
+                    response.close()
+
+                # Fields without a new point since their cursor are unchanged
+                parsed = self.field_cursors.merge(parsed, ALL_FIELDS, incremental)
+                if not parsed:
+                    self.log.error(f"Received empty response from {host}")
+                    self.host_pool.record(host, 0.0, error="empty response")
                     continue
 
-                try:
-                    # Try parsing as CSV first
-                    data = StringIO(response.text)
-                    df = pd.read_csv(data)
-                    if not df.empty:
-                        # Look for battery charge/discharge value (Power.Battery.Charge.Discharge)
-                        battery_charge_discharge = 0.0
-                        if 'Power.Battery.Charge.Discharge' in df['_field'].values:
-                            battery_charge_discharge = df[df['_field'] == 'Power.Battery.Charge.Discharge']['_value'].iloc[-1]
-                            logging.info(f"Found battery power: {battery_charge_discharge}W")
+                values = {field: value for field, (_, value) in parsed.items()}
+                source_time = max((parse_influx_time(point_time) for point_time, _ in parsed.values() if point_time), default=None)
+
+                solar_generation = None
+                if SOLAR_FIELD in values:
+                    solar_generation = {"solar_power_generation": values[SOLAR_FIELD]}
+
+                # A missing field is left out rather than read as 0, so history, derived values and anomaly windows skip it
+                grid_power = None
+                if GRID_EXPORT_FIELD in values and GRID_IMPORT_FIELD in values:
+                    grid_power = {"grid_power": values[GRID_EXPORT_FIELD] - values[GRID_IMPORT_FIELD]}
+
+                battery_data = {key: values[field] for key, field in (("battery_charge_discharge", BATTERY_POWER_FIELD),
+                                                                      ("battery_charge_level", BATTERY_LEVEL_FIELD))
+                                if field in values} or None
+
+                missing = [field for field in ALL_FIELDS if field not in values]
+                if missing:
+                    self.log.warning(f"Fields missing from combined response: {missing}")
+
+                return solar_generation, grid_power, battery_data, source_time
+            except requests.exceptions.RequestException as e:
+                self.log.error(f"Request failed: {e}")
+                if response is not None:
+                    # The headers arrived, the body did not
+                    self.host_pool.record(host, 0.0, error=type(e).__name__)
+            except Exception as e:
+                self.log.error(f"Unexpected error while fetching data from {host}: {str(e)}")
+                self.host_pool.record(host, 0.0, error=type(e).__name__)
+
+        if not self.host_pool.down():
+            self.log.error("No host delivered data.")
+        return None, None, None, None
+
+    def fetch_solar_generation(self):
+        self.log.debug("Fetching solar generation data...")
+        for _ in range(len(self.hosts)):
+            host = self.get_influx_host()
+            if host is None:
+                break
+            query, incremental = self.cursor_query([SOLAR_FIELD], self.solar_query)
+            try:
+                with FETCH_PHASE_SECONDS.time(site=self.name, phase="http"):
+                    response = self.influx_client.query(host, query)
+                observe_response_bytes("solar", response)
+                self.log.debug(f"Response status: {response.status_code} from {host}")
+
+                if response.status_code == 200:
+                    if not response.text.strip() and not incremental:
+                        self.log.error("Received empty response")
+                        continue
+
+                    try:
+                        with FETCH_PHASE_SECONDS.time(site=self.name, phase="parse"), \
+                                INFLUX_PARSE_SECONDS.time(clock=time.thread_time, query="solar"):
+                            parsed = parse_influx_csv(response.text.splitlines())
+                        parsed = self.field_cursors.merge(parsed, [SOLAR_FIELD], incremental)
+                        if SOLAR_FIELD in parsed:
+                            return {"solar_power_generation": parsed[SOLAR_FIELD][1]}
                         else:
-                            logging.warning("Power.Battery.Charge.Discharge not found in response")
-                        
-                        # Look for battery charge level (percentage)
-                        battery_charge_level = 0.0
-                        if 'Percent.Storage.Level' in df['_field'].values:
-                            battery_charge_level = df[df['_field'] == 'Percent.Storage.Level']['_value'].iloc[-1]
-                            logging.info(f"Found battery level: {battery_charge_level}%")
+                            self.log.error(f"{SOLAR_FIELD} not found in response")
+                    except Exception as e:
+                        self.log.error(f"Error parsing CSV response: {str(e)}")
+                        self.log.debug(f"Full response content: {response.text}")
+                else:
+                    self.log.error(f"Data query failed with status {response.status_code}.")
+                    self.log.error(f"Error response: {response.text}")
+            except requests.exceptions.RequestException as e:
+                self.log.error(f"Request failed: {e}")
+            except Exception as e:
+                self.log.error(f"Unexpected error while fetching solar data: {str(e)}")
+                continue
+
+        return None
+
+    def fetch_grid_power(self):
+        self.log.debug("Fetching grid import/export data...")
+        for _ in range(len(self.hosts)):
+            host = self.get_influx_host()
+            if host is None:
+                break
+            query, incremental = self.cursor_query([GRID_EXPORT_FIELD, GRID_IMPORT_FIELD], self.grid_query)
+            try:
+                with FETCH_PHASE_SECONDS.time(site=self.name, phase="http"):
+                    response = self.influx_client.query(host, query)
+                observe_response_bytes("grid", response)
+                self.log.debug(f"Response status: {response.status_code} from {host}")
+
+                if response.status_code == 200:
+                    if not response.text.strip() and not incremental:
+                        self.log.error("Received empty response")
+                        continue
+
+                    try:
+                        with FETCH_PHASE_SECONDS.time(site=self.name, phase="parse"), \
+                                INFLUX_PARSE_SECONDS.time(clock=time.thread_time, query="grid"):
+                            parsed = parse_influx_csv(response.text.splitlines())
+                        parsed = self.field_cursors.merge(parsed, [GRID_EXPORT_FIELD, GRID_IMPORT_FIELD], incremental)
+                        if parsed:
+                            grid_export = parsed.get(GRID_EXPORT_FIELD, (None, 0.0))[1]
+                            grid_import = parsed.get(GRID_IMPORT_FIELD, (None, 0.0))[1]
+                            return {"grid_power": grid_export - grid_import}
                         else:
-                            logging.warning("Percent.Storage.Level not found in response")
-                        
-                        last_working_ip = INFLUX_API.split("//")[1].split(":")[0]
+                            self.log.error("No grid data found in response")
+                    except Exception as e:
+                        self.log.error(f"Error parsing CSV response: {str(e)}")
+                        self.log.debug(f"Full response content: {response.text}")
+                else:
+                    self.log.error(f"Data query failed with status {response.status_code}.")
+                    self.log.error(f"Error response: {response.text}")
+            except requests.exceptions.RequestException as e:
+                self.log.error(f"Request failed: {e}")
+            except Exception as e:
+                self.log.error(f"Unexpected error while fetching grid data: {str(e)}")
+                continue
+
+        return None
+
+    def fetch_battery_data(self):
+        self.log.debug("Fetching battery data...")
+        for _ in range(len(self.hosts)):
+            host = self.get_influx_host()
+            if host is None:
+                break
+            self.log.debug(f"Trying host: {host}")
+            query, incremental = self.cursor_query([BATTERY_POWER_FIELD, BATTERY_LEVEL_FIELD], self.battery_query)
+            try:
+                with FETCH_PHASE_SECONDS.time(site=self.name, phase="http"):
+                    response = self.influx_client.query(host, query, accept="*/*")
+                observe_response_bytes("battery", response)
+                self.log.debug(f"Battery data response status: {response.status_code}")
+
+                if response.status_code == 200:
+                    if not response.text.strip() and not incremental:
+                        self.log.error("Received empty response")
+                        continue
+
+                    try:
+                        # Try parsing as CSV first
+                        with FETCH_PHASE_SECONDS.time(site=self.name, phase="parse"), \
+                                INFLUX_PARSE_SECONDS.time(clock=time.thread_time, query="battery"):
+                            parsed = parse_influx_csv(response.text.splitlines())
+                        parsed = self.field_cursors.merge(parsed, [BATTERY_POWER_FIELD, BATTERY_LEVEL_FIELD], incremental)
+                        if parsed:
+                            # Look for battery charge/discharge value (Power.Battery.Charge.Discharge)
+                            battery_charge_discharge = 0.0
+                            if BATTERY_POWER_FIELD in parsed:
+                                battery_charge_discharge = parsed[BATTERY_POWER_FIELD][1]
+                            else:
+                                self.log.warning("Power.Battery.Charge.Discharge not found in response")
                         
-                        # Log the final values being returned
-                        logging.info(f"Returning battery data - Power: {battery_charge_discharge}W, Level: {battery_charge_level}%")
+                            # Look for battery charge level (percentage)
+                            battery_charge_level = 0.0
+                            if BATTERY_LEVEL_FIELD in parsed:
+                                battery_charge_level = parsed[BATTERY_LEVEL_FIELD][1]
+                            else:
+                                self.log.warning("Percent.Storage.Level not found in response")
                         
-                        return {
-                            "battery_charge_discharge": float(battery_charge_discharge),
-                            "battery_charge_level": float(battery_charge_level)
-                        }
-                    else:
-                        logging.error("DataFrame is empty after parsing CSV")
-                except Exception as csv_error:
-                    logging.error(f"CSV parsing failed: {csv_error}")
-                    try:
-                        # Try parsing as JSON if CSV fails
-                        data = response.json()
-                        if 'numberDataPoints' in data:
-                            # Get battery charge/discharge value from Power.Battery.Charge.Discharge
-                            battery_charge_discharge = data['numberDataPoints'].get('Power.Battery.Charge.Discharge', {}).get('value', 0.0)
-                            logging.info(f"Found battery power from JSON: {battery_charge_discharge}W")
-                            
-                            # Get battery charge level from Percent.Storage.Level
-                            battery_charge_level = data['numberDataPoints'].get('Percent.Storage.Level', {}).get('value', 0.0)
-                            logging.info(f"Found battery level from JSON: {battery_charge_level}%")
-                            
-                            last_working_ip = INFLUX_API.split("//")[1].split(":")[0]
-                            
-                            # Log the final values being returned
-                            logging.info(f"Returning battery data from JSON - Power: {battery_charge_discharge}W, Level: {battery_charge_level}%")
-                            
                             return {
                                 "battery_charge_discharge": float(battery_charge_discharge),
                                 "battery_charge_level": float(battery_charge_level)
                             }
-                    except Exception as json_error:
-                        logging.error(f"JSON parsing failed: {json_error}")
-                        continue
-            else:
-                logging.error(f"Data query failed with status {response.status_code}.")
-                logging.error(f"Response content: {response.text}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
-            last_working_ip = None
-        except Exception as e:
-            logging.error(f"Unexpected error while fetching battery data: {str(e)}")
-            continue
-
-    return None
+                        else:
+                            raise ValueError("no battery fields found in CSV response")
+                    except Exception as csv_error:
+                        self.log.error(f"CSV parsing failed: {csv_error}")
+                        try:
+                            # Try parsing as JSON if CSV fails
+                            data = response.json()
+                            if 'numberDataPoints' in data:
+                                # Get battery charge/discharge value from Power.Battery.Charge.Discharge
+                                battery_charge_discharge = data['numberDataPoints'].get('Power.Battery.Charge.Discharge', {}).get('value', 0.0)
+                            
+                                # Get battery charge level from Percent.Storage.Level
+                                battery_charge_level = data['numberDataPoints'].get('Percent.Storage.Level', {}).get('value', 0.0)
+                            
+                            
+                                return {
+                                    "battery_charge_discharge": float(battery_charge_discharge),
+                                    "battery_charge_level": float(battery_charge_level)
+                                }
+                        except Exception as json_error:
+                            self.log.error(f"JSON parsing failed: {json_error}")
+                            continue
+                else:
+                    self.log.error(f"Data query failed with status {response.status_code}.")
+                    self.log.error(f"Response content: {response.text}")
+            except requests.exceptions.RequestException as e:
+                self.log.error(f"Request failed: {e}")
+            except Exception as e:
+                self.log.error(f"Unexpected error while fetching battery data: {str(e)}")
+                continue
+
+        return None
+
+    def check_recent_timestamps(self):
+        """Check if the timestamps of the last 10 fetches are within the last 2 hours."""
+        if len(self.fetch_timestamps) < 10:
+            return False
+        # The oldest of them is the first
+        return datetime.now() - self.fetch_timestamps[0] < timedelta(hours=2)
+
+def site_history_db(name):
+    """History file of a site from SITES_CONFIG: HISTORY_DB with the site name appended, e.g. data/history-garage.db."""
+    if not HISTORY_DB:
+        return None
+    root, extension = os.path.splitext(HISTORY_DB)
+    return f"{root}-{name}{extension}"
+
+def load_sites():
+    """Create the default site from INFLUX_HOSTS (if set) and one site per entry of SITES_CONFIG.
+
+    SITES_CONFIG is a JSON object mapping site names to the settings of each
+    installation, named like the environment variables (INFLUX_HOSTS,
+    INFLUX_TOKEN, INFLUX_ORG_ID, INFLUX_BUCKET, HISTORY_DB). Settings left out
+    fall back to the environment.
+    """
+    loaded = {}
+    if INFLUX_HOSTS:
+        loaded["default"] = Site("default", INFLUX_HOSTS, INFLUX_TOKEN, INFLUX_ORG_ID, INFLUX_BUCKET, HISTORY_DB)
+    if SITES_CONFIG:
+        with open(SITES_CONFIG) as f:
+            config = json.load(f)
+        for name, settings in config.items():
+            hosts = settings.get("INFLUX_HOSTS", "")
+            if isinstance(hosts, str):
+                hosts = [host.strip() for host in hosts.split(",") if host.strip()]
+            if not re.fullmatch(r"[A-Za-z0-9_-]+", name) or name in loaded or not hosts:
+                logging.error(f"Invalid site {name!r} in {SITES_CONFIG}.")
+                raise ValueError(f"Site {name!r} in {SITES_CONFIG} needs a unique name of letters, digits, - and _ and INFLUX_HOSTS.")
+            loaded[name] = Site(name, hosts, settings.get("INFLUX_TOKEN", INFLUX_TOKEN), settings.get("INFLUX_ORG_ID", INFLUX_ORG_ID),
+                                settings.get("INFLUX_BUCKET", INFLUX_BUCKET), settings.get("HISTORY_DB", site_history_db(name)))
+    if not loaded:
+        logging.error(f"{SITES_CONFIG} does not define any site.")
+        raise ValueError(f"{SITES_CONFIG} does not define any site.")
+    return loaded
+
+# Fetch cycles of all sites run here, host discovery probes on the other executor
+fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+sites = load_sites()
+# The default site is served at the plain URLs, and it is the one on the stream and Modbus ports
+default_site = next(iter(sites.values()))
+discovery_executor = ThreadPoolExecutor(max_workers=sum(len(site.hosts) for site in sites.values()), thread_name_prefix="discovery")
+logging.info(f"Sites: {', '.join(sites)} (default: {default_site.name})")
+
+def flush_history():
+    """Write the queued samples of every site to its history store (scheduled job)."""
+    for site in sites.values():
+        if site.history_store:
+            site.history_store.flush(state={"fetch_count": site.fetch_count})
+
+def compact_history():
+    """Drop samples past the retention from every history store (scheduled job)."""
+    for site in sites.values():
+        if site.history_store:
+            site.history_store.compact()
+
+def render_json(payload):
+    """Serialize a payload once, compact as health_check.sh expects it, and derive a strong ETag from the bytes."""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return body, hashlib.sha1(body).hexdigest()[:20]
+
+def snapshot_payload(solar_generation, grid_power, battery_data, source_time, derived=None):
+    """Flatten all meter and derived values of a cycle into the /snapshot response.
+
+    Keys are kept flat so a cFos meter definition can address each value directly.
+    """
+    payload = {}
+    for meter in (solar_generation, grid_power, battery_data, derived):
+        if meter:
+            payload.update(meter)
+    payload["source_time"] = iso_time(source_time)
+    return payload
+
+def iso_time(timestamp):
+    """Format epoch seconds as an ISO 8601 UTC time, None stays None."""
+    return datetime.fromtimestamp(timestamp, pytz.utc).isoformat() if timestamp else None
+
+def meter_payload(meter, fetched_at, source_time):
+    """A meter body: its values plus when they were fetched and the _time they carry at the source."""
+    return dict(meter, fetched_at=iso_time(fetched_at), source_time=iso_time(source_time))
+
+class Snapshot:
+    """Immutable result of one fetch cycle.
+
+    Site.fetch_data() creates one per cycle and publishes it by replacing the
+    current_snapshot reference of the site, so a reader always sees the values
+    of a single cycle. The JSON bodies served by the endpoints and their ETags are rendered
+    once here instead of on every request.
+    """
 
-def check_stuck_values(history_list):
-    """Check if the data is stuck based on timestamps and value consistency."""
-    if len(history_list) < 10:
-        logging.warning("Not enough data to determine if values are stuck.")
-        return False
-    
-    # Log the history list for debugging
-    logging.debug(f"History list for stuck check: {history_list}")
-    
-    if 'solar_power_generation' in history_list[0][1]:
-        key = 'solar_power_generation'
-    elif 'grid_power' in history_list[0][1]:
-        key = 'grid_power'
-    elif 'battery_charge_level' in history_list[0][1]:
-        key = 'battery_charge_level'
+    def __init__(self, solar_generation, grid_power, battery_data, successful, initialization_phase,
+                 source_time=None, standby=False, derived=None, cycle_id=0):
+        fetched_at = time.time()
+        attributes = {
+            "cycle_id": cycle_id,
+            "fetched_at": fetched_at,
+            "source_time": source_time,
+            "solar_generation": solar_generation,
+            "grid_power": grid_power,
+            "battery_data": battery_data,
+            "derived": derived,
+            "successful": successful,
+            "initialization_phase": initialization_phase,
+            "standby": standby,
+            "bodies": {
+                "solar_generation": render_json(meter_payload(solar_generation, fetched_at, source_time)) if solar_generation else None,
+                "grid_power": render_json(meter_payload(grid_power, fetched_at, source_time)) if grid_power else None,
+                "battery_data": render_json(meter_payload(battery_data, fetched_at, source_time)) if battery_data else None,
+                "derived": render_json(meter_payload(derived, fetched_at, source_time)) if derived else None,
+                "snapshot": render_json(dict(snapshot_payload(solar_generation, grid_power, battery_data, source_time, derived),
+                                             fetched_at=iso_time(fetched_at)))
+                if solar_generation or grid_power or battery_data else None
+            },
+            # Health responses only depend on the snapshot and the verdict, render each at most once
+            "health_bodies": {}
+        }
+        for name, value in attributes.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable")
+
+    def health_body(self, status, message=None, hosts=None):
+        """Return the rendered /health body and ETag for a verdict on this snapshot and the host circuit states."""
+        key = (status, message, tuple(hosts.items()) if hosts else None)
+        rendered = self.health_bodies.get(key)
+        if rendered is None:
+            payload = {"status": status}
+            if message:
+                payload["message"] = message
+            payload.update({
+                "solar_generation": self.solar_generation,
+                "grid_power": self.grid_power,
+                "battery_data": self.battery_data,
+                "initialization_phase": self.initialization_phase
+            })
+            if hosts:
+                payload["hosts"] = hosts
+            rendered = self.health_bodies[key] = render_json(payload)
+        return rendered
+
+STANDBY_HEALTH = render_json({
+    "status": "healthy",
+    "message": "System in standby (outside operating hours)",
+    "solar_generation": {"solar_power_generation": 0.0},
+    "grid_power": {"grid_power": 0.0},
+    "battery_data": {
+        "battery_charge_discharge": 0.0,
+        "battery_charge_level": 0.0
+    },
+    "initialization_phase": False
+})
+
+def serve_json(body, etag, status=200):
+    """Serve a pre-rendered JSON body, answering a matching If-None-Match with 304."""
+    if status == 200 and request.if_none_match.contains(etag):
+        response = Response(status=304)
     else:
-        logging.error("Unknown data format in history list")
-        return False
-    
-    timestamps = [entry[0] for entry in history_list]
-    values = [entry[1][key] for entry in history_list]
-    
-    # Get the current time
-    current_time = datetime.now()
-    
-    # Check if all timestamps are older than 2 hours
-    if all(current_time - ts > timedelta(hours=2) for ts in timestamps):
-        logging.warning("All timestamps are older than 2 hours. Data is stuck.")
-        return True
-    
-    # Check if all values are the same (regardless of timestamp)
-    if len(set(values)) == 1:
-        logging.warning("Detected stuck values in the history list.")
-        return True
-    
-    logging.info("Values and timestamps are not stuck.")
-    return False
-
-def check_recent_timestamps():
-    """Check if the timestamps of the last 10 fetches are within the last 2 hours."""
-    if len(fetch_timestamps) < 10:
-        return False
-    return all(datetime.now() - ts < timedelta(hours=2) for ts in fetch_timestamps)
+        response = Response(body, status=status, mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
-@app.route('/solar_generation', methods=['GET'])
-def get_solar_generation():
-    if cached_solar_generation:
-        logging.debug(f"Returning solar generation data: {cached_solar_generation}")
-        return jsonify(cached_solar_generation), 200
-    else:
-        logging.error("Failed to fetch solar generation data")
-        return jsonify({"error": "Failed to fetch data"}), 500
-
-@app.route('/grid_power', methods=['GET'])
-def get_grid_power():
-    if cached_grid_power:
-        logging.debug(f"Returning grid power data: {cached_grid_power}")
-        return jsonify(cached_grid_power), 200
-    else:
-        logging.error("Failed to fetch grid power data")
-        return jsonify({"error": "Failed to fetch data"}), 500
-
-@app.route('/battery_data', methods=['GET'])
-def get_battery_data():
-    if cached_battery_data:
-        logging.debug(f"Returning battery data: {cached_battery_data}")
-        return jsonify(cached_battery_data), 200
-    else:
-        logging.error("Failed to fetch battery data")
-        return jsonify({"error": "Failed to fetch data"}), 500
+def serve_meter(site, name):
+    """Serve the body of one meter from the current snapshot of a site.
 
-@app.route('/health', methods=['GET'])
-def health_check():
+    With ?max_age=<seconds>, values older than that trigger a refresh that all
+    concurrent requests share. mode=wait (default) answers with the refreshed
+    values, mode=stale answers right away with the current ones while the refresh
+    runs. The Age header tells how old the served values are.
+    """
+    snapshot = site.current_snapshot
+    max_age = request.args.get("max_age")
+    if max_age is not None:
+        try:
+            max_age = max(float(max_age), REFRESH_MIN_AGE)
+        except ValueError:
+            return jsonify({"error": "max_age must be a number of seconds"}), 400
+        mode = request.args.get("mode", "wait")
+        if mode not in ("wait", "stale"):
+            return jsonify({"error": "mode must be wait or stale"}), 400
+        if snapshot is None or time.time() - snapshot.fetched_at > max_age:
+            site.fetch_flight.do(wait=mode == "wait", timeout=INFLUX_CONNECT_TIMEOUT + INFLUX_READ_TIMEOUT)
+            if mode == "wait":
+                snapshot = site.current_snapshot
+
+    rendered = snapshot.bodies[name] if snapshot else None
+    if rendered:
+        response = serve_json(*rendered)
+        response.headers["Age"] = str(int(time.time() - snapshot.fetched_at))
+        return response
+    site.log.error(f"Failed to fetch {name.replace('_', ' ')} data")
+    return jsonify({"error": "Failed to fetch data"}), 500
+
+def site_route(rule, **options):
+    """Register a view of one site at rule for the default site and at /sites/<name><rule> for every site.
+
+    The view gets the Site as its only argument.
+    """
+    def decorator(view):
+        @wraps(view)
+        def dispatch(site_name=None):
+            site = default_site if site_name is None else sites.get(site_name)
+            if site is None:
+                return jsonify({"error": f"Unknown site, use one of: {', '.join(sites)}"}), 404
+            return view(site)
+        app.add_url_rule(rule, view_func=dispatch, **options)
+        app.add_url_rule(f"/sites/<site_name>{rule}", view_func=dispatch, **options)
+        return dispatch
+    return decorator
+
+@site_route('/solar_generation', methods=['GET'])
+def get_solar_generation(site):
+    return serve_meter(site, "solar_generation")
+
+@site_route('/grid_power', methods=['GET'])
+def get_grid_power(site):
+    return serve_meter(site, "grid_power")
+
+@site_route('/battery_data', methods=['GET'])
+def get_battery_data(site):
+    return serve_meter(site, "battery_data")
+
+@site_route('/derived', methods=['GET'])
+def get_derived(site):
+    """PV surplus, smoothed power, today's energy totals and battery SoC rate, computed once per cycle."""
+    return serve_meter(site, "derived")
+
+@site_route('/snapshot', methods=['GET'])
+def get_snapshot(site):
+    """All meter values of the latest cycle plus their source timestamp in one response."""
+    return serve_meter(site, "snapshot")
+
+@app.route('/sites', methods=['GET'])
+def list_sites():
+    """Every site with its URL prefix, host circuit states, request latency per host and the state of its latest snapshot."""
+    result = {}
+    for name, site in sites.items():
+        snapshot = site.current_snapshot
+        result[name] = {
+            "url": f"/sites/{name}",
+            "default": site is default_site,
+            "hosts": site.host_pool.summary(),
+            "latency": site.influx_client.stats(),
+            "successful": snapshot.successful if snapshot else None,
+            "fetched_at": iso_time(snapshot.fetched_at) if snapshot else None
+        }
+    return jsonify(result)
+
+@site_route('/history', methods=['GET'])
+def get_history(site):
+    """Downsampled history of one value, e.g. /history?field=grid_power&start=2024-06-01T06:00&max_points=500"""
+    field = request.args.get("field", "")
+    if field not in site.history:
+        return jsonify({"error": f"Unknown field, use one of: {', '.join(site.history)}"}), 400
+    now = time.time()
+    try:
+        end = parse_history_time(request.args.get("end"), now)
+        start = parse_history_time(request.args.get("start"), end - 86400)
+        max_points = min(max(int(request.args.get("max_points", 500)), 2), 10000)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    if start > end:
+        return jsonify({"error": "start must not be after end"}), 400
+
+    newest = site.history[field].last()
+    if newest and end < newest[0]:
+        return serve_json(*render_closed_history(site, field, start, end, max_points))
+    return serve_json(*render_history(site, field, start, end, max_points))
+
+@site_route('/health', methods=['GET'])
+def health_check(site):
     if not is_within_time_range():
         # During off-hours, always return healthy with 0 values
-        return jsonify({
-            "status": "healthy",
-            "message": "System in standby (outside operating hours)",
-            "solar_generation": {"solar_power_generation": 0.0},
-            "grid_power": {"grid_power": 0.0},
-            "battery_data": {
-                "battery_charge_discharge": 0.0,
-                "battery_charge_level": 0.0
-            },
-            "initialization_phase": False
-        }), 200
-
-    if no_working_ip_found:
-        logging.error("Health check failed: No working IP found, Enpal box seems down.")
-        return jsonify({"status": "unhealthy", "reason": "No working IP found, Enpal box seems down."}), 500
-    elif data_fetch_successful:
-        solar_value = cached_solar_generation.get('solar_power_generation', 'N/A')
-        grid_value = cached_grid_power.get('grid_power', 'N/A')
-        battery_level = cached_battery_data.get('battery_charge_level', 'N/A')
-        battery_power = cached_battery_data.get('battery_charge_discharge', 'N/A')
-        logging.warning(f"Latest Values - S: {solar_value}, G: {grid_value}, B_lvl: {battery_level}, B_pwr: {battery_power}")
+        return serve_json(*STANDBY_HEALTH)
+
+    snapshot = site.current_snapshot
+    problem = supervisor.unhealthy(site)
+    if problem:
+        return jsonify({"status": "unhealthy", "reason": f"Recovery failed: {problem}", "hosts": site.host_pool.stats()}), 500
+    if site.host_pool.down():
+        site.log.error("Health check failed: No working IP found, Enpal box seems down.")
+        return jsonify({"status": "unhealthy", "reason": "No working IP found, Enpal box seems down.",
+                        "hosts": site.host_pool.stats()}), 500
+    elif snapshot and snapshot.successful:
+        hosts = site.host_pool.summary()
+        solar_value = snapshot.solar_generation.get('solar_power_generation', 'N/A')
+        grid_value = snapshot.grid_power.get('grid_power', 'N/A')
+        battery_level = snapshot.battery_data.get('battery_charge_level', 'N/A')
+        battery_power = snapshot.battery_data.get('battery_charge_discharge', 'N/A')
+        site.log.debug(f"Latest Values - S: {solar_value}, G: {grid_value}, B_lvl: {battery_level}, B_pwr: {battery_power}")
 
         # Only check for stuck values if not in initialization phase
-        if not initialization_phase:
+        if not snapshot.initialization_phase:
             # First check if timestamps are recent enough
-            if not check_recent_timestamps():
-                log_all_datasets("Data timestamps are too old")
-                return jsonify({
-                    "status": "warning",
-                    "message": "Data timestamps are too old",
-                    "solar_generation": cached_solar_generation,
-                    "grid_power": cached_grid_power,
-                    "battery_data": cached_battery_data,
-                    "initialization_phase": initialization_phase
-                }), 208
-
-            # Then check if all datasets show the same values
-            solar_values = [entry[1]['solar_power_generation'] for entry in solar_generation_history[-60:]]
-            grid_values = [entry[1]['grid_power'] for entry in grid_power_history[-60:]]
-            battery_level_values = [entry[1]['battery_charge_level'] for entry in battery_data_history[-60:]]
-            battery_power_values = [entry[1]['battery_power'] for entry in battery_data_history[-60:]]
-
-            if (len(set(solar_values)) == 1 and 
-                len(set(grid_values)) == 1 and 
-                len(set(battery_level_values)) == 1 and
-                len(set(battery_power_values)) == 1):
-                log_all_datasets("Stuck values detected in all data sets")
-                return jsonify({
-                    "status": "warning",
-                    "message": "Stuck values detected in all data sets",
-                    "solar_generation": cached_solar_generation,
-                    "grid_power": cached_grid_power,
-                    "battery_data": cached_battery_data,
-                    "initialization_phase": initialization_phase
-                }), 208
-
-        return jsonify({
-            "status": "healthy",
-            "solar_generation": cached_solar_generation,
-            "grid_power": cached_grid_power,
-            "battery_data": cached_battery_data,
-            "initialization_phase": initialization_phase
-        }), 200
+            if not site.check_recent_timestamps():
+                log_warning_condition(site, "Data timestamps are too old")
+                return serve_json(*snapshot.health_body("warning", "Data timestamps are too old", hosts), status=208)
+
+            # Then the verdict of the anomaly detector, computed by the fetch cycle and logged there
+            verdict = site.anomalies.verdict
+            if verdict:
+                return serve_json(*snapshot.health_body("warning", verdict, hosts), status=208)
+
+        return serve_json(*snapshot.health_body("healthy", hosts=hosts))
     else:
-        logging.error("Health check failed")
-        return jsonify({"status": "unhealthy"}), 500
-
-def retry_ip_verification():
-    """Retry IP verification every hour if no working IP is found."""
-    if no_working_ip_found:
-        logging.info("Retrying IP verification after an hour...")
-        verify_working_ip()
-    # Schedule the next retry in 1 hour (3600 seconds)
-    Timer(3600, retry_ip_verification).start()
-
-def log_all_datasets(reason):
-    """Log all datasets when a warning condition is detected."""
-    logging.warning(f"Warning condition detected: {reason}")
-    logging.warning("Current data in memory:")
-    logging.warning(f"Solar Generation History (last 60):")
-    for ts, data in solar_generation_history[-60:]:
-        logging.warning(f"  {ts}: {data}")
-    logging.warning(f"Grid Power History (last 60):")
-    for ts, data in grid_power_history[-60:]:
-        logging.warning(f"  {ts}: {data}")
-    logging.warning(f"Battery Data History (last 60):")
-    for ts, data in battery_data_history[-60:]:
-        logging.warning(f"  {ts}: {data}")
+        site.log.error("Health check failed")
+        return jsonify({"status": "unhealthy", "hosts": site.host_pool.stats()}), 500
+
+CACHE_AGE_SECONDS = Gauge("enpal_cache_age_seconds", "Seconds since each meter value was last fetched.", ["site", "meter"],
+                          callback=lambda: {(site.name, key): round(time.time() - buffer.last()[0], 3)
+                                            for site in sites.values() for key, buffer in site.history.items() if len(buffer)})
+SCHEDULER_OVERRUNS = Counter("enpal_scheduler_overruns_total", "Scheduled job runs that took longer than their interval.", ["job"],
+                             callback=lambda: {(name,): stats["overruns"] for name, stats in scheduler.stats().items()})
+INFLUX_CIRCUIT_STATE = Gauge("enpal_influx_circuit_state", "Circuit breaker state per host (0 closed, 1 half-open, 2 open).", ["site", "host"],
+                             callback=lambda: {(site.name, host): CIRCUIT_STATES[state]
+                                               for site in sites.values() for host, state in site.host_pool.summary().items()})
+INFLUX_HOST_SCORE = Gauge("enpal_influx_host_score", "Rolling success rate per host used to order failover.", ["site", "host"],
+                          callback=lambda: {(site.name, host): stats["score"]
+                                            for site in sites.values() for host, stats in site.host_pool.stats().items()})
+POLL_INTERVAL_SECONDS = Gauge("enpal_poll_interval_seconds", "Current interval of the adaptive fetch schedule.", ["site"],
+                              callback=lambda: {(site.name,): site.poll_interval for site in sites.values()})
+FIELD_ANOMALIES = Gauge("enpal_field_anomaly", "1 while a meter value is frozen (unexpectedly) or showed an implausible jump.",
+                        ["site", "field", "kind"],
+                        callback=lambda: {(site.name, key, kind): int(flagged)
+                                          for site in sites.values() for key in HISTORY_KEYS
+                                          for kind, flagged in (("frozen", key in site.anomalies.stuck()),
+                                                                ("jump", key in site.anomalies.jumps))})
+SCHEDULER_RUNS = Counter("enpal_scheduler_runs_total", "Completed scheduled job runs.", ["job"],
+                         callback=lambda: {(name,): stats["runs"] for name, stats in scheduler.stats().items()})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if "request_started" in g:
+        HTTP_REQUEST_SECONDS.observe(time.monotonic() - g.request_started, endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+def log_warning_condition(site, reason, endpoint="/debug/history"):
+    """Log a health warning once, pointing to the debug endpoint with the data behind it."""
+    path = endpoint if site is default_site else f"/sites/{site.name}{endpoint}"
+    site.log.warning(f"Warning condition detected: {reason} (details: GET {path})")
+
+@site_route('/debug/history', methods=['GET'])
+def debug_history(site):
+    """Dump the latest n samples (default STUCK_WINDOW) of every history buffer of a site."""
+    try:
+        n = min(max(int(request.args.get("n", STUCK_WINDOW)), 1), HISTORY_DEPTH)
+    except ValueError:
+        return jsonify({"error": "n must be an integer"}), 400
+    return jsonify({key: [[datetime.fromtimestamp(ts).isoformat(), value] for ts, value in zip(*buffer.window(n))]
+                    for key, buffer in site.history.items()})
+
+@site_route('/debug/anomalies', methods=['GET'])
+def debug_anomalies(site):
+    """Dump the anomaly detector state of a site: window statistics, frozen values and jumps."""
+    return jsonify(site.anomalies.state())
+
+def shutdown(signum, frame):
+    """Stop the scheduler cleanly on SIGTERM/SIGINT."""
+    logging.warning(f"Received signal {signum}, shutting down.")
+    supervisor.stop()
+    scheduler.stop(timeout=INFLUX_CONNECT_TIMEOUT + INFLUX_READ_TIMEOUT)
+    flush_history()
+    raise SystemExit(0)
+
+class StreamServer:
+    """Pushes every new snapshot to Server-Sent Events subscribers.
+
+    All subscribers are served from one selector thread with non-blocking
+    sockets, so idle clients cost a socket and a small buffer instead of a
+    thread (or a WSGI worker). publish() only hands the encoded event over and
+    wakes the loop; clients that cannot keep up are disconnected.
+    """
+    MAX_BUFFERED_BYTES = 65536
+    RESPONSE_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                        b"Content-Type: text/event-stream\r\n"
+                        b"Cache-Control: no-cache\r\n"
+                        b"Connection: keep-alive\r\n"
+                        b"Access-Control-Allow-Origin: *\r\n\r\n")
+
+    def __init__(self, host, port, heartbeat, max_clients):
+        self.address = (host, port)
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}  # socket -> {"subscribed": bool, "inbox": bytes, "outbox": bytearray}
+        self.pending = []
+        self.latest_event = None
+        self.last_event_at = time.monotonic()
+        self.lock = Lock()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.events_sent = 0
+
+    def start(self):
+        listener = socket.create_server(self.address, reuse_port=False)
+        listener.setblocking(False)
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, "accept")
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, "wake")
+        Thread(target=self.run, name="stream", daemon=True).start()
+        logging.info(f"Serving snapshot stream on {self.address[0]}:{self.address[1]}")
+
+    def publish(self, snapshot):
+        """Queue a snapshot for all subscribers (called from the fetch thread)."""
+        rendered = snapshot.bodies["snapshot"]
+        data = rendered[0] if rendered else b"{}"
+        event = b"id: %d\nevent: snapshot\ndata: %s\n\n" % (snapshot.cycle_id, data)
+        with self.lock:
+            self.pending.append(event)
+            self.latest_event = event
+        try:
+            self.wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # Wake-up already pending
+
+    def subscriber_count(self):
+        return sum(1 for client in list(self.clients.values()) if client["subscribed"])
+
+    def run(self):
+        while True:
+            timeout = max(0.0, self.last_event_at + self.heartbeat - time.monotonic())
+            for key, events in self.selector.select(timeout):
+                if key.data == "accept":
+                    self.accept(key.fileobj)
+                elif key.data == "wake":
+                    self.drain_wakeups()
+                else:
+                    if events & selectors.EVENT_READ:
+                        self.read(key.fileobj)
+                    if events & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                        self.flush(key.fileobj)
+
+            with self.lock:
+                pending, self.pending = self.pending, []
+            for event in pending:
+                self.broadcast(event)
+            if time.monotonic() - self.last_event_at >= self.heartbeat:
+                self.broadcast(self.heartbeat_event())
+
+    def drain_wakeups(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def accept(self, listener):
+        try:
+            connection, _ = listener.accept()
+        except OSError:
+            return
+        if len(self.clients) >= self.max_clients:
+            connection.close()
+            return
+        connection.setblocking(False)
+        self.clients[connection] = {"subscribed": False, "inbox": b"", "outbox": bytearray()}
+        self.selector.register(connection, selectors.EVENT_READ, "client")
+
+    def read(self, connection):
+        client = self.clients.get(connection)
+        try:
+            data = connection.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data or client is None:
+            self.close(connection)
+            return
+        if client["subscribed"]:
+            return  # Nothing is expected from subscribers, ignore it
+
+        client["inbox"] += data
+        if b"\r\n\r\n" not in client["inbox"]:
+            if len(client["inbox"]) > 8192:
+                self.close(connection)
+            return
+
+        request_line = client["inbox"].split(b"\r\n", 1)[0].split()
+        if len(request_line) < 2 or request_line[0] != b"GET" or request_line[1].split(b"?")[0] != b"/stream":
+            client["outbox"] += b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+            client["close_after_flush"] = True
+            self.flush(connection)
+            return
+
+        client["subscribed"] = True
+        client["inbox"] = b""
+        client["outbox"] += self.RESPONSE_HEADERS
+        with self.lock:
+            latest = self.latest_event
+        # New subscribers start with the current values instead of waiting for the next cycle
+        client["outbox"] += latest or self.heartbeat_event()
+        self.flush(connection)
+
+    def broadcast(self, event):
+        self.last_event_at = time.monotonic()
+        for connection, client in list(self.clients.items()):
+            if client["subscribed"]:
+                client["outbox"] += event
+                self.events_sent += 1
+                self.flush(connection)
+
+    def flush(self, connection):
+        client = self.clients.get(connection)
+        if client is None:
+            return
+        try:
+            sent = connection.send(client["outbox"])
+            del client["outbox"][:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.close(connection)
+            return
+
+        if not client["outbox"]:
+            if client.get("close_after_flush"):
+                self.close(connection)
+            else:
+                self.selector.modify(connection, selectors.EVENT_READ, "client")
+        elif len(client["outbox"]) > self.MAX_BUFFERED_BYTES:
+            logging.warning("Dropping stream subscriber that does not keep up.")
+            self.close(connection)
+        else:
+            self.selector.modify(connection, selectors.EVENT_READ | selectors.EVENT_WRITE, "client")
+
+    def close(self, connection):
+        self.clients.pop(connection, None)
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+    def heartbeat_event(self):
+        """Build a heartbeat telling subscribers why no new snapshot arrived."""
+        snapshot = default_site.current_snapshot
+        if snapshot is None:
+            state = "waiting"
+        elif snapshot.standby:
+            state = "standby"
+        else:
+            state = "stale"
+        age = round(time.time() - snapshot.fetched_at, 1) if snapshot else None
+        return b"event: heartbeat\ndata: %s\n\n" % json.dumps({"state": state, "age": age}).encode()
+
+stream_server = StreamServer(HTTP_HOST, STREAM_PORT, STREAM_HEARTBEAT, STREAM_MAX_CLIENTS) if STREAM_PORT else None
+
+STREAM_SUBSCRIBERS = Gauge("enpal_stream_subscribers", "Connected Server-Sent Events subscribers.",
+                           callback=lambda: {(): stream_server.subscriber_count() if stream_server else 0})
+STREAM_EVENTS = Counter("enpal_stream_events_total", "Events written to stream subscribers.",
+                        callback=lambda: {(): stream_server.events_sent if stream_server else 0})
+
+class ModbusServer:
+    """Modbus TCP server exposing the current snapshot as read-only registers.
+
+    Unit ids 1, 2 and 3 are the grid, solar and battery meter in the register
+    layout of an Eastron SDM630 (SDM630_METERS), which charging managers and
+    wallboxes support without a custom definition. Every other unit id serves
+    the enpal-link layout: big-endian float32 values, two registers each, at
+    the addresses in REGISTERS, followed by the source time (uint32 epoch
+    seconds) and a status register. Holding (function 3) and input registers
+    (function 4) hold the same images. They are packed once per cycle by
+    publish(); requests only slice them. All masters are served from one
+    selector thread.
+    """
+    SDM630_METERS = {  # unit id -> (power key, sign, import kWh key, export kWh key); SDM630 power is positive on import
+        1: ("grid_power", -1, "energy_import_today_kwh", "energy_export_today_kwh"),
+        2: ("solar_power_generation", 1, "energy_production_today_kwh", None),
+        3: ("battery_charge_discharge", 1, None, None)
+    }
+    SDM630_POWER = 0x34  # Total system power (W)
+    SDM630_IMPORT = 0x48  # Import active energy (kWh)
+    SDM630_EXPORT = 0x4A  # Export active energy (kWh)
+    SDM630_TOTAL = 0x156  # Total active energy (kWh)
+    SDM630_SIZE = SDM630_TOTAL + 2  # Registers of the image, the ones without a value read as NaN
+    REGISTERS = [  # (address, value key); the meter and derived values of a snapshot
+        (0, "solar_power_generation"),
+        (2, "grid_power"),
+        (4, "battery_charge_discharge"),
+        (6, "battery_charge_level"),
+        (8, "pv_surplus"),
+        (10, "grid_power_ema"),
+        (12, "solar_power_ema"),
+        (14, "energy_import_today_kwh"),
+        (16, "energy_export_today_kwh"),
+        (18, "energy_production_today_kwh"),
+        (20, "battery_soc_rate")
+    ]
+    SOURCE_TIME_REGISTER = 22
+    STATUS_REGISTER = 24  # 0 no data, 1 ok, 2 fetch failed, 3 standby
+    IMAGE_FORMAT = ">" + "f" * len(REGISTERS) + "IH"
+    MAX_REGISTERS = 125  # Per read request, as in the Modbus specification
+
+    def __init__(self, host, port, max_clients):
+        self.address = (host, port)
+        self.max_clients = max_clients
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}  # socket -> {"inbox": bytes, "outbox": bytearray}
+        self.image = struct.pack(self.IMAGE_FORMAT, *([math.nan] * len(self.REGISTERS)), 0, 0)
+        self.sdm630_images = {unit: self.sdm630_image({}, *meter) for unit, meter in self.SDM630_METERS.items()}
+        self.requests_served = 0
+
+    def start(self):
+        listener = socket.create_server(self.address, reuse_port=False)
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, "accept")
+        Thread(target=self.run, name="modbus", daemon=True).start()
+        logging.info(f"Serving Modbus TCP on {self.address[0]}:{self.address[1]}")
+
+    def publish(self, snapshot):
+        """Pack the register image of a snapshot; replacing the reference makes it visible at once."""
+        values = {}
+        for meter in (snapshot.solar_generation, snapshot.grid_power, snapshot.battery_data, snapshot.derived):
+            if meter:
+                values.update(meter)
+        floats = [float(values[key]) if values.get(key) is not None else math.nan for _, key in self.REGISTERS]
+        status = 3 if snapshot.standby else 1 if snapshot.successful else 2
+        self.sdm630_images = {unit: self.sdm630_image(values, *meter) for unit, meter in self.SDM630_METERS.items()}
+        self.image = struct.pack(self.IMAGE_FORMAT, *floats, int(snapshot.source_time or 0), status)
+
+    def sdm630_image(self, values, power_key, sign, import_key, export_key):
+        """Pack the SDM630 input registers of one meter, unavailable values stay NaN."""
+        image = bytearray(struct.pack(f">{self.SDM630_SIZE // 2}f", *([math.nan] * (self.SDM630_SIZE // 2))))
+        power = values.get(power_key)
+        imported, exported = values.get(import_key), values.get(export_key)
+        registers = {self.SDM630_POWER: power * sign if power is not None else None,
+                     self.SDM630_IMPORT: imported,
+                     self.SDM630_EXPORT: exported,
+                     self.SDM630_TOTAL: imported + exported if imported is not None and exported is not None else None}
+        for address, value in registers.items():
+            if value is not None:
+                struct.pack_into(">f", image, address * 2, value)
+        return bytes(image)
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.data == "accept":
+                    self.accept(key.fileobj)
+                else:
+                    if events & selectors.EVENT_READ:
+                        self.read(key.fileobj)
+                    if events & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                        self.flush(key.fileobj)
+
+    def accept(self, listener):
+        try:
+            connection, _ = listener.accept()
+        except OSError:
+            return
+        if len(self.clients) >= self.max_clients:
+            connection.close()
+            return
+        connection.setblocking(False)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients[connection] = {"inbox": b"", "outbox": bytearray()}
+        self.selector.register(connection, selectors.EVENT_READ, "client")
+
+    def read(self, connection):
+        client = self.clients.get(connection)
+        try:
+            data = connection.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data or client is None:
+            self.close(connection)
+            return
+
+        inbox = client["inbox"] + data
+        # Answer every complete frame; masters may pipeline several requests
+        while len(inbox) >= 7:
+            transaction, protocol, length, unit = struct.unpack(">HHHB", inbox[:7])
+            if protocol != 0 or not 2 <= length <= 254:
+                self.close(connection)
+                return
+            if len(inbox) < 6 + length:
+                break
+            pdu, inbox = inbox[7:6 + length], inbox[6 + length:]
+            response = self.handle(pdu, unit)
+            client["outbox"] += struct.pack(">HHHB", transaction, 0, len(response) + 1, unit) + response
+            self.requests_served += 1
+        client["inbox"] = inbox
+        self.flush(connection)
+
+    def handle(self, pdu, unit=0):
+        """Answer one request PDU from the current image of a unit."""
+        function = pdu[0]
+        if function not in (3, 4):
+            return bytes((function | 0x80, 1))  # Illegal function
+        if len(pdu) != 5:
+            return bytes((function | 0x80, 3))  # Illegal data value
+        address, quantity = struct.unpack(">HH", pdu[1:5])
+        if not 1 <= quantity <= self.MAX_REGISTERS:
+            return bytes((function | 0x80, 3))
+        image = self.sdm630_images.get(unit, self.image)
+        if (address + quantity) * 2 > len(image):
+            return bytes((function | 0x80, 2))  # Illegal data address
+        return bytes((function, quantity * 2)) + image[address * 2:(address + quantity) * 2]
+
+    def flush(self, connection):
+        client = self.clients.get(connection)
+        if client is None or not client["outbox"]:
+            return
+        try:
+            sent = connection.send(client["outbox"])
+            del client["outbox"][:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.close(connection)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client["outbox"] else 0)
+        self.selector.modify(connection, events, "client")
+
+    def close(self, connection):
+        self.clients.pop(connection, None)
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+modbus_server = ModbusServer(HTTP_HOST, MODBUS_PORT, MODBUS_MAX_CLIENTS) if MODBUS_PORT else None
+
+MODBUS_CLIENTS = Gauge("enpal_modbus_clients", "Connected Modbus TCP masters.",
+                       callback=lambda: {(): len(modbus_server.clients) if modbus_server else 0})
+MODBUS_REQUESTS = Counter("enpal_modbus_requests_total", "Modbus TCP requests answered.",
+                          callback=lambda: {(): modbus_server.requests_served if modbus_server else 0})
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """Redirect to the Server-Sent Events stream, which is served on STREAM_PORT."""
+    if not stream_server:
+        return jsonify({"error": "Stream is disabled"}), 404
+    host = request.host.rsplit(":", 1)[0] if not request.host.endswith("]") else request.host
+    return redirect(f"{request.scheme}://{host}:{STREAM_PORT}/stream", code=307)
+
+class Supervisor:
+    """Repairs the fetch loop of every site in place instead of restarting the container.
+
+    A site has a problem when no fetch cycle finished for SUPERVISOR_STALL seconds,
+    SUPERVISOR_FAILURES cycles in a row failed or the anomaly detector reports
+    stuck values other than solar power alone. Each check that still sees the
+    problem takes the next step, once a cycle could show the effect of the
+    previous one:
+
+    1. reset: close the HTTP connections and forget the query cursors
+    2. rediscover: probe every host, open circuits included
+    3. restart: abandon a hanging cycle and restart the fetch job (and the scheduler thread if it died)
+    4. unhealthy: report the site on /health and /health/ready
+
+    The last snapshot is served all the time. A site without a problem is back at step 0.
+    """
+    STEPS = ["reset", "rediscover", "restart", "unhealthy"]
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.states = {}
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        now = time.monotonic()
+        self.states = {name: {"step": 0, "problem": None, "since": None, "acted_at": now, "watched_from": now, "recoveries": 0}
+                       for name in sites}
+        self.thread = Thread(target=self.run, name="supervisor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def alive(self):
+        return bool(self.thread and self.thread.is_alive())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for site in list(sites.values()):
+                try:
+                    self.check(site)
+                except Exception as e:
+                    site.log.exception(f"Supervisor check failed: {e}")
+
+    def problem(self, site, state):
+        """Return what is wrong with the fetch loop of a site, or None."""
+        now = time.monotonic()
+        if not is_within_time_range():
+            # No cycles run in standby, the stall clock starts when they are due again
+            state["watched_from"] = now
+            return None
+        if now - max(site.cycle_finished, state["watched_from"]) > SUPERVISOR_STALL:
+            return f"no fetch cycle finished for {now - site.cycle_finished:.0f}s"
+        if site.failed_cycles >= SUPERVISOR_FAILURES:
+            return f"{site.failed_cycles} failed fetch cycles in a row"
+        # Flat solar power alone is no fault of the fetch loop, only act while another value is frozen
+        stuck = site.anomalies.stuck()
+        if stuck and stuck != ["solar_power_generation"] and not site.initialization_phase:
+            return f"stuck values in {', '.join(stuck)}"
+        return None
+
+    def check(self, site):
+        now = time.monotonic()
+        state = self.states[site.name]
+        problem = self.problem(site, state)
+        if problem is None:
+            if state["step"]:
+                site.log.warning(f"Recovered after {now - state['since']:.0f}s at step {self.STEPS[state['step'] - 1]}.")
+                state.update(step=0, problem=None, since=None, recoveries=state["recoveries"] + 1)
+            return
+
+        # A step has shown its effect once a cycle finished after it, or when a cycle had all the time it may take
+        settled = site.cycle_finished > state["acted_at"] or \
+            now - state["acted_at"] > site.poll_interval + INFLUX_CONNECT_TIMEOUT + INFLUX_READ_TIMEOUT
+        state["problem"] = problem
+        if state["step"] == 0:
+            state["since"] = now
+        elif not settled:
+            return
+        elif state["step"] == len(self.STEPS):
+            if site.cycle_finished < state["acted_at"] and now - state["acted_at"] > SUPERVISOR_STALL:
+                # Still stalled while reported unhealthy, keep trying to restart the fetch loop
+                state["acted_at"] = now
+                site.log.warning(f"Restarting the fetch worker again ({problem}).")
+                site.restart_fetch_worker()
+            return
+        step = self.STEPS[state["step"]]
+        state.update(step=state["step"] + 1, acted_at=now)
+        SUPERVISOR_ACTIONS.inc(site=site.name, action=step)
+        if step == "unhealthy":
+            site.log.error(f"Recovery failed ({problem}), reporting unhealthy.")
+            return
+        site.log.warning(f"Recovery step {state['step']}/{len(self.STEPS)}: {step} ({problem}).")
+        if step == "reset":
+            site.influx_client.reset()
+            site.field_cursors.reset()
+        elif step == "rediscover":
+            # Probes may take a full request timeout, the other sites are checked meanwhile
+            Thread(target=site.discover_working_host, args=(site.hosts,), name=f"rediscover-{site.name}", daemon=True).start()
+        else:
+            site.restart_fetch_worker()
+
+    def unhealthy(self, site):
+        """Return the problem the recovery steps could not fix, or None."""
+        state = self.states.get(site.name)
+        return state["problem"] if state and state["step"] == len(self.STEPS) else None
+
+    def stats(self, site):
+        state = self.states.get(site.name)
+        if not state:
+            return None
+        return {"step": self.STEPS[state["step"] - 1] if state["step"] else None, "problem": state["problem"],
+                "seconds": round(time.monotonic() - state["since"], 1) if state["since"] else None,
+                "recoveries": state["recoveries"]}
+
+supervisor = Supervisor(SUPERVISOR_INTERVAL)
+
+SUPERVISOR_ACTIONS = Counter("enpal_supervisor_actions_total", "Recovery steps taken by the supervisor.", ["site", "action"])
+SUPERVISOR_STEP = Gauge("enpal_supervisor_step", "Recovery step a site is at (0 none, 4 unhealthy).", ["site"],
+                        callback=lambda: {(name,): state["step"] for name, state in supervisor.states.items()})
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness for the Docker HEALTHCHECK: the scheduler and supervisor threads run and no fetch loop stalled for good.
+
+    A site that is unhealthy because the Enpal box fails is still alive, a restart would not help it.
+    """
+    reasons = []
+    if not scheduler.alive():
+        reasons.append("scheduler not running")
+    if SUPERVISOR_INTERVAL and not supervisor.alive():
+        reasons.append("supervisor not running")
+    for site in sites.values():
+        problem = supervisor.unhealthy(site)
+        if problem and time.monotonic() - site.cycle_finished > SUPERVISOR_STALL:
+            reasons.append(f"{site.name}: {problem}")
+    if reasons:
+        return jsonify({"status": "dead", "reasons": reasons}), 503
+    return jsonify({"status": "alive"})
+
+@site_route('/health/ready', methods=['GET'])
+def health_ready(site):
+    """Readiness: the site serves values of a successful cycle (or standby zeros) and is not reported unhealthy."""
+    if not is_within_time_range():
+        return jsonify({"status": "ready", "standby": True})
+    problem = supervisor.unhealthy(site)
+    if problem:
+        return jsonify({"status": "not_ready", "reason": problem}), 503
+    snapshot = site.current_snapshot
+    if not snapshot or not snapshot.successful:
+        return jsonify({"status": "not_ready", "reason": "No successful fetch cycle yet" if not snapshot else "Last fetch cycle failed",
+                        "recovery": supervisor.stats(site)}), 503
+    return jsonify({"status": "ready", "age": round(time.time() - snapshot.fetched_at, 1), "recovery": supervisor.stats(site)})
+
+background_tasks_started = False
+background_tasks_lock = Lock()
+
+def start_background_tasks():
+    """Start the fetch loop of every site and the retry mechanism, at most once per process."""
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
+    for site in sites.values():
+        site.restore_history()
+        # The scheduler only hands the cycles to the fetch executor, a tick while one is in flight joins it
+        scheduler.add_job(site.job, site.poll_interval, site.tick, jitter=FETCH_JITTER)
+    if any(site.history_store for site in sites.values()):
+        scheduler.add_job("history_flush", HISTORY_FLUSH_INTERVAL, flush_history, delay=HISTORY_FLUSH_INTERVAL)
+        scheduler.add_job("history_compact", 3600, compact_history)
+    scheduler.start()
+    if SUPERVISOR_INTERVAL:
+        supervisor.start()
+    if stream_server:
+        stream_server.start()
+    if modbus_server:
+        modbus_server.start()
+
+def create_app():
+    """App factory for external WSGI servers, e.g. `waitress-serve --call enpal:create_app`."""
+    start_background_tasks()
+    return app
 
 if __name__ == "__main__":
     logging.info("Script started")
-    fetch_data()  # Start the initial data fetch
-    retry_ip_verification()  # Start the retry mechanism
-    app.run(host=HTTP_HOST, port=HTTP_PORT, debug=False)  # Set debug to False
+    start_background_tasks()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    if SERVER_MODE == "production":
+        from waitress import serve
+        logging.info(f"Serving with waitress on {HTTP_HOST}:{HTTP_PORT} using {WSGI_THREADS} threads")
+        serve(app, host=HTTP_HOST, port=HTTP_PORT, threads=WSGI_THREADS, ident="enpal-link")
+    else:
+        app.run(host=HTTP_HOST, port=HTTP_PORT, debug=False)  # Set debug to False
@@ -45,8 +45,8 @@ check_health() {
             message=$(echo $response_body | grep -o '"message":"[^"]*"' | cut -d'"' -f4)
             log "Warning: $message"
             send_email "Stuck Values Alert" "$message\n\nFull response:\n$response_body"
-            restart_server
-            return 1
+            # enpal-link repairs stuck values itself and answers 500 once that failed, no restart here
+            return 0
         fi
         log "Server not healthy, sleeping for $SLEEP_INTERVAL seconds"
         sleep $SLEEP_INTERVAL
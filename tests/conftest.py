@@ -0,0 +1,53 @@
+"""enpal.py is imported once against two local fake InfluxDB hosts, with nothing listening or persisted."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_influx import FakeInflux  # noqa: E402
+
+# A new point every cycle, so incremental queries always have something to return
+FAKES = [FakeInflux(port=0, point_interval=0.001, seed=seed).start() for seed in (1, 2)]
+
+os.environ.update({
+    "INFLUX_HOSTS": ",".join(fake.address for fake in FAKES),
+    "INFLUX_TOKEN": "test",
+    "INFLUX_ORG_ID": "test",
+    "INFLUX_BUCKET": "solar",
+    "INFLUX_CONNECT_TIMEOUT": "0.5",
+    "INFLUX_READ_TIMEOUT": "2",
+    "START_TIME": "00:00",
+    "END_TIME": "23:59",
+    "LATITUDE": "",
+    "LONGITUDE": "",
+    "STREAM_PORT": "0",
+    "MODBUS_PORT": "0",
+    "HISTORY_DB": "",
+    "LOG_LEVEL": "CRITICAL",
+})
+
+import enpal  # noqa: E402
+
+
+@pytest.fixture
+def fakes():
+    yield FAKES
+    for fake in FAKES:
+        fake.latency = fake.error_rate = fake.empty_rate = fake.hang_rate = 0.0
+        fake.dead = False
+
+
+@pytest.fixture
+def site(fakes):
+    """The default site with fresh host breakers, sessions and cursors."""
+    site = enpal.default_site
+    site.host_pool = enpal.HostPool(site.hosts, enpal.BREAKER_FAILURES, enpal.BREAKER_BACKOFF, enpal.BREAKER_MAX_BACKOFF)
+    site.influx_client = enpal.InfluxClient(site.hosts, enpal.INFLUX_TOKEN, enpal.INFLUX_ORG_ID,
+                                            enpal.INFLUX_CONNECT_TIMEOUT, enpal.INFLUX_READ_TIMEOUT, site.host_pool)
+    site.field_cursors = enpal.FieldCursors(enpal.flux_duration_seconds(enpal.QUERY_RANGE_START))
+    enpal.scheduler.add_job(site.job, site.poll_interval, lambda: None)  # Target of adapt_poll_interval(), not started
+    return site
@@ -0,0 +1,44 @@
+import enpal
+
+
+def feed(detector, cycles, values, start=1e9):
+    """Feed cycles at 10 s intervals; values maps a key to a constant or a function of the cycle index."""
+    for index in range(cycles):
+        detector.update(start + index * 10, {key: value(index) if callable(value) else value for key, value in values.items()})
+
+
+def detector():
+    return enpal.AnomalyDetector({key: None for key in enpal.HISTORY_KEYS}, 10)
+
+
+def test_flat_solar_in_daylight_is_normal_while_grid_and_battery_move(monkeypatch):
+    monkeypatch.setattr(enpal, "sun_is_up", lambda timestamp, inset=0: True)
+    anomalies = detector()
+    feed(anomalies, 15, {"solar_power_generation": 1234.0, "grid_power": lambda i: -300.0 + i,
+                         "battery_charge_discharge": lambda i: 1500.0 - i, "battery_charge_level": lambda i: 50.0 + i / 10})
+    assert anomalies.stuck() == []
+    assert anomalies.frozen["solar_power_generation"] == "grid or battery still change"
+    assert anomalies.verdict is None
+
+    # Snow on the panels: no production in daylight
+    feed(anomalies, 15, {"solar_power_generation": 0.0, "grid_power": lambda i: -300.0 + i,
+                         "battery_charge_discharge": lambda i: -500.0 - i, "battery_charge_level": lambda i: 50.0 - i / 10})
+    assert anomalies.stuck() == []
+
+
+def test_flat_solar_is_stuck_when_grid_and_battery_are_frozen_too(monkeypatch):
+    monkeypatch.setattr(enpal, "sun_is_up", lambda timestamp, inset=0: True)
+    anomalies = detector()
+    feed(anomalies, 15, {"solar_power_generation": 1234.0, "grid_power": 321.0,
+                         "battery_charge_discharge": 2500.0, "battery_charge_level": 50.0})
+    assert "solar_power_generation" in anomalies.stuck()
+    assert "grid_power" in anomalies.stuck()
+    assert anomalies.verdict.startswith("Stuck values detected in")
+
+
+def test_no_solar_at_night_is_normal():
+    anomalies = detector()  # No coordinates: no solar power is always accepted
+    feed(anomalies, 15, {"solar_power_generation": 0.0, "grid_power": -300.0,
+                         "battery_charge_discharge": 2500.0, "battery_charge_level": lambda i: 50.0 + i / 10})
+    assert anomalies.frozen["solar_power_generation"] == "no sun"
+    assert "solar_power_generation" not in anomalies.stuck()
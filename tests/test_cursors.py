@@ -0,0 +1,62 @@
+import time
+from datetime import datetime, timezone
+
+import enpal
+
+FIELDS = ["Power.Grid.Export", "Power.Grid.Import"]
+
+
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def test_cursor_range_starts_at_the_oldest_field():
+    cursors = enpal.FieldCursors(300)
+    now = time.time()
+    assert cursors.start(FIELDS) is None
+
+    cursors.merge({FIELDS[0]: (rfc3339(now - 5), 800.0)}, FIELDS[:1], incremental=False)
+    assert cursors.start(FIELDS) is None  # Import has no cursor yet
+    cursors.merge({FIELDS[1]: (rfc3339(now - 30), 0.0)}, FIELDS[1:], incremental=False)
+    assert cursors.start(FIELDS) == rfc3339(now - 30)
+
+
+def test_unchanged_fields_keep_their_point():
+    cursors = enpal.FieldCursors(300)
+    now = time.time()
+    cursors.merge({FIELDS[0]: (rfc3339(now - 20), 800.0), FIELDS[1]: (rfc3339(now - 20), 0.0)}, FIELDS, incremental=False)
+
+    merged = cursors.merge({FIELDS[0]: (rfc3339(now - 10), 650.0)}, FIELDS, incremental=True)
+    assert merged == {FIELDS[0]: (rfc3339(now - 10), 650.0), FIELDS[1]: (rfc3339(now - 20), 0.0)}
+    # An older point never moves a cursor back
+    merged = cursors.merge({FIELDS[0]: (rfc3339(now - 15), 700.0)}, FIELDS, incremental=True)
+    assert merged[FIELDS[0]] == (rfc3339(now - 10), 650.0)
+
+
+def test_window_query_rebuilds_the_cursors():
+    cursors = enpal.FieldCursors(300)
+    now = time.time()
+    cursors.merge({FIELDS[0]: (rfc3339(now - 20), 800.0), FIELDS[1]: (rfc3339(now - 20), 0.0)}, FIELDS, incremental=False)
+    assert cursors.merge({FIELDS[0]: (rfc3339(now - 5), 810.0)}, FIELDS, incremental=False) == {
+        FIELDS[0]: (rfc3339(now - 5), 810.0)}
+
+
+def test_gaps_and_absolute_ranges_query_the_window():
+    stale = enpal.FieldCursors(300)
+    stale.merge({field: (rfc3339(time.time() - 600), 1.0) for field in FIELDS}, FIELDS, incremental=False)
+    assert stale.start(FIELDS) is None
+
+    absolute = enpal.FieldCursors(enpal.flux_duration_seconds("2024-06-01T00:00:00Z"))
+    absolute.merge({field: (rfc3339(time.time()), 1.0) for field in FIELDS}, FIELDS, incremental=False)
+    assert absolute.start(FIELDS) is None
+
+
+def test_site_queries_since_the_cursors_after_the_first_cycle(site):
+    site.field_cursors.reset()
+    query, incremental = site.cursor_query(enpal.ALL_FIELDS, site.combined_query)
+    assert not incremental and query == site.combined_query
+
+    site.fetch_all_data()
+    query, incremental = site.cursor_query(enpal.ALL_FIELDS, site.combined_query)
+    assert incremental
+    assert f"range(start: {site.field_cursors.start(enpal.ALL_FIELDS)})" in query.decode()
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+import enpal
+
+
+def local_time(day, hour, minute=0):
+    moment = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=minute)
+    return pytz.timezone(enpal.TIMEZONE).localize(moment).timestamp()
+
+
+def test_midnight_restarts_averages_and_totals(site):
+    derived = enpal.DerivedValues(site.history)
+    day = datetime(2026, 6, 1).date()
+    derived.update(local_time(day, 23, 59), {"grid_power": 4000.0, "solar_power_generation": 5000.0})
+    after = derived.update(local_time(day + timedelta(days=1), 0, 0), {"grid_power": -200.0, "solar_power_generation": 0.0})
+
+    assert after["grid_power_ema"] == -200.0
+    assert after["solar_power_ema"] == 0.0
+    assert after["energy_export_today_kwh"] == 0.0
+    assert after["energy_production_today_kwh"] == 0.0
+
+
+def test_pv_surplus_is_never_negative(site):
+    derived = enpal.DerivedValues(site.history)
+    day = datetime(2026, 6, 1).date()
+    charging = derived.update(local_time(day, 12), {"grid_power": 1500.0, "battery_charge_discharge": 800.0})
+    assert charging["pv_surplus"] == 2300.0
+    discharging = derived.update(local_time(day, 20), {"grid_power": 0.0, "battery_charge_discharge": -1200.0})
+    assert discharging["pv_surplus"] == 0.0
@@ -0,0 +1,60 @@
+def warm_up(site):
+    for _ in range(3):
+        site.fetch_data()
+    working = site.host_pool.working()
+    assert working
+    return working
+
+
+def test_empty_response_fails_over_to_next_host(site, fakes):
+    working = warm_up(site)
+    fake = next(fake for fake in fakes if fake.address == working)
+    fake.empty_rate = 1.0
+    site.field_cursors.reset()  # An empty incremental answer would still merge the cursor values
+
+    result = site.fetch_all_data()
+    assert all(part is not None for part in result)
+    assert site.host_pool.stats()[working]["last_error"] == "empty response"
+    assert site.host_pool.working() != working
+
+
+def test_error_table_fails_over_to_next_host(site, fakes, monkeypatch):
+    working = warm_up(site)
+    fake = next(fake for fake in fakes if fake.address == working)
+    monkeypatch.setattr(fake, "render_csv", lambda query, dialect, points: ",result,table,error,reference\r\n,,0,broken,\r\n\r\n")
+
+    result = site.fetch_all_data()
+    assert all(part is not None for part in result)
+    assert site.host_pool.stats()[working]["last_error"] == "InfluxQueryError"
+
+
+def test_no_host_returns_the_same_shape(site, fakes):
+    warm_up(site)
+    for fake in fakes:
+        fake.empty_rate = 1.0
+    site.field_cursors.reset()
+    assert site.fetch_all_data() == (None, None, None, None)
+    site.fetch_data()
+    assert site.failed_cycles >= 1
+
+
+def test_missing_fields_are_left_out(site, fakes, monkeypatch):
+    warm_up(site)
+    site.field_cursors.reset()  # Without cursors the merge cannot fill in older values
+    dropped = {"Power.Grid.Import", "Percent.Storage.Level"}
+    for fake in fakes:
+        render_csv = fake.render_csv
+        monkeypatch.setattr(fake, "render_csv", lambda query, dialect, points, render_csv=render_csv:
+                            render_csv(query, dialect, [point for point in points if point[1] not in dropped]))
+    history = {key: len(buffer) for key, buffer in site.history.items()}
+
+    solar_generation, grid_power, battery_data, _ = site.fetch_all_data()
+    assert solar_generation is not None
+    assert grid_power is None
+    assert list(battery_data) == ["battery_charge_discharge"]
+
+    site.fetch_data()
+    assert not site.current_snapshot.successful
+    assert len(site.history["grid_power"]) == history["grid_power"]
+    assert len(site.history["battery_charge_level"]) == history["battery_charge_level"]
+    assert len(site.history["battery_charge_discharge"]) > history["battery_charge_discharge"]
@@ -0,0 +1,9 @@
+import re
+
+
+def test_health_message_matches_health_check_script(site):
+    site.fetch_data()
+    body, _ = site.current_snapshot.health_body("warning", "Stuck values detected in grid_power")
+    # The pattern health_check.sh extracts the message with
+    match = re.search(r'"message":"[^"]*"', body.decode())
+    assert match and match.group(0).split('"')[3] == "Stuck values detected in grid_power"
@@ -0,0 +1,69 @@
+import time
+
+import enpal
+
+
+def test_history_store_is_opened_by_restore_only(site, tmp_path):
+    path = tmp_path / "data" / "history.db"
+    other = enpal.Site("other", site.hosts, "test", "test", "solar", str(path))
+    assert other.history_store is None and not path.parent.exists()
+
+    other.restore_history()
+    try:
+        assert path.exists()
+        assert other.history_store.path == str(path)
+    finally:
+        other.history_store.connection.close()
+
+
+def test_downsample_keeps_the_extremes():
+    timestamps = [float(ts) for ts in range(1000)]
+    values = [0.0] * 1000
+    values[123], values[777] = 5000.0, -3000.0
+
+    reduced_ts, reduced = enpal.downsample_minmax(timestamps, values, 20)
+    assert len(reduced) <= 20
+    assert reduced_ts == sorted(reduced_ts)
+    assert (123.0, 5000.0) in zip(reduced_ts, reduced) and (777.0, -3000.0) in zip(reduced_ts, reduced)
+
+
+def test_store_round_trip_across_reopening(tmp_path):
+    path = str(tmp_path / "history.db")
+    now = time.time()
+    store = enpal.HistoryStore(path, 7)
+    store.record(now - 20, {"grid_power": -150.0, "battery_charge_level": 60.0})
+    store.record(now - 10, {"grid_power": 820.0, "battery_charge_level": 61.0})
+    store.record(now - 8 * 86400, {"grid_power": 5.0})  # Past the retention
+    assert store.flush(state={"fetch_count": 42}) == 5
+    store.connection.close()
+
+    reopened = enpal.HistoryStore(path, 7)
+    try:
+        assert reopened.load("grid_power", 10) == [(now - 20, -150.0), (now - 10, 820.0)]
+        assert reopened.load("grid_power", 1) == [(now - 10, 820.0)]
+        assert reopened.range("battery_charge_level", now - 15, now) == ([now - 10], [61.0])
+        assert reopened.load_state() == {"fetch_count": 42}
+        assert reopened.compact() == 1
+        assert reopened.range("grid_power", 0, now)[1] == [-150.0, 820.0]
+    finally:
+        reopened.connection.close()
+
+
+def test_restart_restores_history_and_fetch_count(site, tmp_path):
+    path = str(tmp_path / "history.db")
+    before = enpal.Site("before", site.hosts, "test", "test", "solar", path)
+    before.restore_history()
+    for level in (60.0, 61.0, 62.0):
+        before.update_history({"solar_power_generation": 1000.0}, {"grid_power": 200.0},
+                              {"battery_charge_discharge": 500.0, "battery_charge_level": level})
+    before.history_store.flush(state={"fetch_count": 3})
+    before.history_store.connection.close()
+
+    after = enpal.Site("after", site.hosts, "test", "test", "solar", path)
+    after.restore_history()
+    try:
+        assert list(after.history["battery_charge_level"].window(3)[1]) == [60.0, 61.0, 62.0]
+        assert after.fetch_count == 3
+        assert after.derived_values.current is not None
+    finally:
+        after.history_store.connection.close()
@@ -0,0 +1,46 @@
+import time
+
+import enpal
+
+
+def test_circuit_opens_after_consecutive_failures():
+    pool = enpal.HostPool(["a", "b"], 2, 60, 600)
+    pool.record("a", 0.1, error="HTTP 500")
+    assert pool.summary()["a"] == "closed"
+    pool.record("a", 0.1, error="HTTP 500")
+    assert pool.summary()["a"] == "open"
+    assert pool.candidates() == ["b"]
+    assert not pool.down()
+
+    pool.record("b", 0.1, error="ConnectTimeout")
+    pool.record("b", 0.1, error="ConnectTimeout")
+    assert pool.candidates() == [] and pool.down()
+    assert pool.stats()["b"]["last_error"] == "ConnectTimeout"
+
+
+def test_half_open_trial_closes_or_reopens_the_circuit():
+    pool = enpal.HostPool(["a"], 1, 0.05, 1.0)
+    pool.record("a", 0.1, error="HTTP 500")
+    assert pool.candidates() == []
+    time.sleep(0.06)
+    assert pool.candidates() == ["a"] and pool.summary()["a"] == "half_open"
+
+    # A failed trial reopens at once, with a longer backoff
+    pool.record("a", 0.1, error="HTTP 500")
+    assert pool.summary()["a"] == "open" and pool.stats()["a"]["trips"] == 2
+    time.sleep(0.11)
+    assert pool.candidates() == ["a"]
+    pool.record("a", 0.1)
+    assert pool.summary()["a"] == "closed"
+    assert pool.stats()["a"]["failures"] == 0 and pool.working() == "a"
+
+
+def test_hosts_are_ordered_by_recent_failures_score_and_latency():
+    pool = enpal.HostPool(["slow", "fast", "flaky"], 3, 60, 600)
+    for _ in range(3):
+        pool.record("slow", 0.5)
+        pool.record("fast", 0.05)
+        pool.record("flaky", 0.01)
+    pool.record("flaky", 0.01, error="ReadTimeout")
+    assert pool.candidates() == ["fast", "slow", "flaky"]
+    assert pool.working() == "fast"
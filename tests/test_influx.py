@@ -0,0 +1,12 @@
+import enpal
+
+
+def test_client_counts_latency_per_host(site, fakes):
+    fakes[0].error_rate = 1.0
+    for _ in range(3):
+        site.fetch_data()
+
+    latency = enpal.app.test_client().get("/sites").get_json()["default"]["latency"]
+    assert sum(stats["requests"] for stats in latency.values()) >= 3
+    assert latency[fakes[0].address]["errors"] >= 1
+    assert all(stats["max_seconds"] >= (stats["avg_seconds"] or 0.0) for stats in latency.values())
@@ -0,0 +1,19 @@
+import json
+import logging
+import queue
+
+import enpal
+
+
+def test_queued_exception_keeps_its_own_key():
+    records = queue.SimpleQueue()
+    logger = logging.Logger("test")
+    logger.addHandler(enpal.LogQueueHandler(records))
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("Fetch failed for %s", "host")
+
+    entry = json.loads(enpal.JsonFormatter().format(records.get_nowait()))
+    assert entry["message"] == "Fetch failed for host"
+    assert entry["exception"].startswith("Traceback") and "ZeroDivisionError" in entry["exception"]
@@ -0,0 +1,38 @@
+import math
+import struct
+
+import enpal
+
+
+def read(server, unit, address, quantity, function=4):
+    response = server.handle(struct.pack(">BHH", function, address, quantity), unit)
+    assert response[:2] == bytes((function, quantity * 2))
+    return struct.unpack(f">{quantity // 2}f", response[2:])
+
+
+def publish(server):
+    server.publish(enpal.Snapshot({"solar_power_generation": 4200.0}, {"grid_power": 1500.0},
+                                  {"battery_charge_discharge": -800.0, "battery_charge_level": 64.0},
+                                  successful=True, initialization_phase=False, source_time=1_700_000_000,
+                                  derived={"energy_import_today_kwh": 1.5, "energy_export_today_kwh": 6.25,
+                                           "energy_production_today_kwh": 12.0}))
+
+
+def test_sdm630_meters_per_unit():
+    server = enpal.ModbusServer("127.0.0.1", 0, 1)
+    publish(server)
+
+    assert read(server, 1, 0x34, 2) == (-1500.0,)  # Export reads as negative import
+    assert read(server, 1, 0x48, 4) == (1.5, 6.25)
+    assert read(server, 1, 0x156, 2) == (7.75,)
+    assert read(server, 2, 0x34, 2) == (4200.0,)
+    assert read(server, 3, 0x34, 2, function=3) == (-800.0,)
+    assert all(math.isnan(value) for value in read(server, 1, 0, 6))  # No phase voltages
+
+
+def test_other_units_serve_the_enpal_layout():
+    server = enpal.ModbusServer("127.0.0.1", 0, 1)
+    publish(server)
+
+    assert read(server, 10, 0, 8) == (4200.0, 1500.0, -800.0, 64.0)
+    assert server.handle(struct.pack(">BHH", 4, 0x34, 2), 10) == bytes((0x84, 2))  # Past the end of the layout
@@ -0,0 +1,62 @@
+import pytest
+
+import enpal
+
+ANNOTATED = (
+    "#datatype,string,long,dateTime:RFC3339,double,string\r\n"
+    "#group,false,false,false,false,true\r\n"
+    "#default,_result,,,,\r\n"
+    ",result,table,_time,_value,_field\r\n"
+    ",,0,2024-06-01T10:59:50Z,3512.5,Power.Production.Total\r\n"
+    ",,0,2024-06-01T10:59:52Z,3600,Power.Production.Total\r\n"
+    "\r\n"
+    "#datatype,string,long,dateTime:RFC3339,long,string\r\n"
+    "#group,false,false,false,false,true\r\n"
+    "#default,_result,,,,\r\n"
+    ",result,table,_time,_value,_field\r\n"
+    ",,1,2024-06-01T10:59:51Z,63,Percent.Storage.Level\r\n"
+    "\r\n"
+)
+
+
+def test_annotated_tables_keep_the_last_row_per_field():
+    assert enpal.parse_influx_csv(ANNOTATED.splitlines()) == {
+        "Power.Production.Total": ("2024-06-01T10:59:52Z", 3600.0),
+        "Percent.Storage.Level": ("2024-06-01T10:59:51Z", 63.0),
+    }
+
+
+def test_plain_tables_with_repeated_headers():
+    text = (",result,table,_time,_value,_field\r\n"
+            ",,0,2024-06-01T10:59:52Z,812,Power.Grid.Export\r\n"
+            ",result,table,_time,_value,_field\r\n"
+            ",,1,2024-06-01T10:59:52Z,0,Power.Grid.Import\r\n")
+    assert enpal.parse_influx_csv(text.splitlines()) == {
+        "Power.Grid.Export": ("2024-06-01T10:59:52Z", 812.0),
+        "Power.Grid.Import": ("2024-06-01T10:59:52Z", 0.0),
+    }
+
+
+def test_string_values_and_non_field_tables_are_skipped():
+    text = ("#datatype,string,long,string,string\r\n"
+            ",result,table,_value,_field\r\n"
+            ",,0,on,Inverter.State\r\n"
+            "\r\n"
+            ",result,table,_value\r\n"
+            ",,0,1\r\n")
+    assert enpal.parse_influx_csv(text.splitlines()) == {}
+
+
+@pytest.mark.parametrize("text", ["", "\r\n", "\r\n\r\n"])
+def test_empty_bodies(text):
+    assert enpal.parse_influx_csv(text.splitlines()) == {}
+
+
+def test_error_table_raises():
+    text = ",result,table,error,reference\r\n,,0,bucket not found,\r\n\r\n"
+    with pytest.raises(enpal.InfluxQueryError, match="bucket not found"):
+        enpal.parse_influx_csv(text.splitlines())
+
+
+def test_nanosecond_times():
+    assert enpal.parse_influx_time("2024-06-01T10:59:52.123456789Z") == pytest.approx(1717239592.123456)
@@ -0,0 +1,58 @@
+import time
+from threading import Thread
+
+import enpal
+
+
+def test_concurrent_callers_share_one_run():
+    runs = []
+    flight = enpal.SingleFlight(lambda: (runs.append(1), time.sleep(0.2)), "test")
+    callers = [Thread(target=flight.do) for _ in range(5)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(5)
+    assert len(runs) == 1
+    assert flight.running() is None
+
+    flight.do()
+    assert len(runs) == 2
+
+
+def test_background_run_and_failures():
+    flight = enpal.SingleFlight(lambda: time.sleep(0.2), "test")
+    done = flight.do(wait=False)
+    assert not done.is_set() and flight.running() is not None
+    assert flight.do(wait=False) is done
+    assert done.wait(5)
+
+    failing = enpal.SingleFlight(lambda: 1 / 0, "test")
+    assert failing.do().is_set()
+    assert failing.running() is None  # A failed run does not block the next one
+
+
+def fetched_at(response):
+    return response.get_json()["fetched_at"]
+
+
+def test_max_age_waits_for_or_skips_the_refresh(site, fakes, monkeypatch):
+    monkeypatch.setattr(enpal, "REFRESH_MIN_AGE", 0.0)
+    client = enpal.app.test_client()
+    site.fetch_data()
+    cached = fetched_at(client.get("/grid_power"))
+
+    time.sleep(0.01)
+    refreshed = client.get("/grid_power?max_age=0")
+    assert fetched_at(refreshed) > cached and "Age" in refreshed.headers
+
+    for fake in fakes:
+        fake.latency = 0.5
+    started = time.monotonic()
+    stale = client.get("/grid_power?max_age=0&mode=stale")
+    assert time.monotonic() - started < 0.4
+    assert fetched_at(stale) == fetched_at(refreshed)
+    site.fetch_flight.do(wait=True, timeout=5)
+    assert fetched_at(client.get("/grid_power")) > fetched_at(stale)
+
+    assert client.get("/grid_power?max_age=soon").status_code == 400
+    assert client.get("/grid_power?max_age=1&mode=later").status_code == 400
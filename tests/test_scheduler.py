@@ -0,0 +1,100 @@
+import time
+
+import enpal
+
+
+def test_slow_fetch_cycles_count_as_overruns(site, fakes):
+    for fake in fakes:
+        fake.latency = 0.6
+    site.fetch_flight = enpal.SingleFlight(site.run_cycle, f"refresh {site.name}", executor=enpal.fetch_executor)
+    enpal.scheduler.add_job(site.job, 0.2, site.tick)
+    enpal.scheduler.start()
+    try:
+        time.sleep(1.5)
+    finally:
+        enpal.scheduler.stop(timeout=5)
+        site.fetch_flight.do(wait=True, timeout=5)
+    stats = enpal.scheduler.stats()[site.job]
+    assert stats["overruns"] >= 2
+    assert 'enpal_scheduler_overruns_total{job="fetch_default"}' in enpal.render_metrics()
+
+
+def test_fast_fetch_cycles_do_not_overrun(site):
+    site.fetch_flight = enpal.SingleFlight(site.run_cycle, f"refresh {site.name}", executor=enpal.fetch_executor)
+    enpal.scheduler.add_job(site.job, 0.5, site.tick)
+    overruns = enpal.scheduler.stats()[site.job]["overruns"]
+    enpal.scheduler.start()
+    try:
+        time.sleep(1.2)
+    finally:
+        enpal.scheduler.stop(timeout=5)
+        site.fetch_flight.do(wait=True, timeout=5)
+    assert enpal.scheduler.stats()[site.job]["overruns"] == overruns
+
+
+def test_restarted_fetch_worker_keeps_the_job_counters(site):
+    enpal.scheduler.overrun(site.job, 1.0)
+    before = enpal.scheduler.stats()[site.job]
+    try:
+        site.restart_fetch_worker()
+    finally:
+        enpal.scheduler.stop(timeout=5)
+        site.fetch_flight.do(wait=True, timeout=5)
+    after = enpal.scheduler.stats()[site.job]
+    assert after["runs"] >= before["runs"] and after["overruns"] >= before["overruns"] >= 1
+
+
+def test_poll_interval_speeds_up_while_values_change(site):
+    site.poll_interval = enpal.FETCH_INTERVAL
+    now = time.time()
+    site.history["grid_power"].append(now, 0.0)
+    site.history["grid_power"].append(now + 1, enpal.POLL_CHANGE_THRESHOLD)
+    site.adapt_poll_interval()
+    assert site.poll_interval == enpal.POLL_INTERVAL_MIN < enpal.FETCH_INTERVAL
+
+    for second in range(2, 12):
+        site.history["grid_power"].append(now + second, enpal.POLL_CHANGE_THRESHOLD)
+        site.history["battery_charge_discharge"].append(now + second, 0.0)
+        site.adapt_poll_interval()
+    assert site.poll_interval == enpal.POLL_INTERVAL_MAX
+
+
+def run_for(scheduler, seconds):
+    scheduler.start()
+    try:
+        time.sleep(seconds)
+    finally:
+        scheduler.stop(timeout=5)
+    assert not scheduler.alive()
+
+
+def test_ticks_keep_a_fixed_rate():
+    scheduler = enpal.Scheduler()
+    ticks = []
+    scheduler.add_job("sample", 0.1, lambda: (ticks.append(time.monotonic()), time.sleep(0.03)))
+    run_for(scheduler, 0.65)
+
+    # The 30 ms a run takes does not push the later ticks back
+    assert len(ticks) >= 5
+    for index, tick in enumerate(ticks):
+        assert abs(tick - (ticks[0] + index * 0.1)) < 0.03
+
+
+def test_slow_runs_skip_ticks_instead_of_piling_up():
+    scheduler = enpal.Scheduler()
+    scheduler.add_job("slow", 0.1, lambda: time.sleep(0.25))
+    run_for(scheduler, 0.9)
+
+    stats = scheduler.stats()["slow"]
+    assert stats["runs"] <= 4
+    assert stats["overruns"] == stats["runs"]
+
+
+def test_rescheduled_job_waits_for_its_delay():
+    scheduler = enpal.Scheduler()
+    ticks = []
+    scheduler.add_job("off_hours", 0.05, lambda: ticks.append(time.monotonic()))
+    scheduler.reschedule("off_hours", 0.3)
+    started = time.monotonic()
+    run_for(scheduler, 0.4)
+    assert ticks and ticks[0] - started >= 0.28
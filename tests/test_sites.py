@@ -0,0 +1,15 @@
+import enpal
+
+
+def test_each_site_numbers_its_snapshots_without_gaps(site):
+    other = enpal.Site("other", site.hosts, "test", "test", "solar")
+    enpal.scheduler.add_job(other.job, other.poll_interval, lambda: None)
+    ids = {site.name: [], other.name: []}
+    for _ in range(3):
+        for current in (site, other):
+            current.fetch_data()
+            ids[current.name].append(current.current_snapshot.cycle_id)
+
+    assert ids[other.name] == [1, 2, 3]
+    first = ids[site.name][0]
+    assert ids[site.name] == [first, first + 1, first + 2]
@@ -0,0 +1,29 @@
+import time
+
+import enpal
+
+
+def problem(site, stuck):
+    site.anomalies.frozen = {key: None for key in stuck}
+    site.initialization_phase = False
+    site.failed_cycles = 0
+    site.cycle_finished = time.monotonic()
+    state = {"watched_from": time.monotonic()}
+    return enpal.supervisor.problem(site, state)
+
+
+def test_stuck_solar_alone_is_not_repaired(site):
+    try:
+        assert problem(site, ["solar_power_generation"]) is None
+        assert problem(site, ["solar_power_generation", "grid_power"]) == \
+            "stuck values in solar_power_generation, grid_power"
+    finally:
+        site.anomalies.frozen = {}
+
+
+def test_failed_cycles_start_a_recovery(site):
+    site.failed_cycles = enpal.SUPERVISOR_FAILURES
+    try:
+        assert enpal.supervisor.problem(site, {"watched_from": time.monotonic()}).endswith("failed fetch cycles in a row")
+    finally:
+        site.failed_cycles = 0